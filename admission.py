@@ -0,0 +1,113 @@
+import threading
+import time
+
+# Load shedding for the chat endpoints. Both limiters live in the worker
+# process and are shared by all of its request threads.
+
+
+class AdmissionController:
+    """
+    Caps the chat turns (and so the LLM calls) running at once in this worker.
+    A turn over the cap may wait briefly in a short queue; when the queue is
+    full, or the wait runs out, the turn is shed and the caller answers
+    without the LLM. max_active=0 disables the cap.
+    """
+
+    def __init__(self, max_active: int, max_waiting: int = 2, wait_timeout: float = 2.0):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        """Take a slot, waiting at most wait_timeout; False means the turn is shed"""
+        with self._cond:
+            if not self.max_active or self.active < self.max_active:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.max_waiting or self.wait_timeout <= 0:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.wait_timeout
+                while self.active >= self.max_active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_active": self.max_active,
+                "max_waiting": self.max_waiting,
+                "wait_timeout": self.wait_timeout,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "shed": self.shed,
+            }
+
+
+class UserRateLimiter:
+    """
+    One token bucket per user: `burst` messages at once, refilled at
+    `rate_per_minute`. rate_per_minute=0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 5, max_users: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = {}  # user id -> (tokens, time.monotonic() of the last update)
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id) -> float:
+        """Take one token; returns 0 if allowed, else seconds until the next token"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[user_id] = (tokens, now)
+                self.limited += 1
+                return (1 - tokens) / self.rate
+            self.buckets[user_id] = (tokens - 1, now)
+            if len(self.buckets) > self.max_users:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now: float):
+        """Forget users whose bucket has refilled; they start full again anyway"""
+        refill_time = self.burst / self.rate
+        self.buckets = {user_id: (tokens, updated) for user_id, (tokens, updated) in self.buckets.items()
+                        if now - updated < refill_time}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_minute": round(self.rate * 60, 2),
+                "burst": self.burst,
+                "users_tracked": len(self.buckets),
+                "limited": self.limited,
+            }
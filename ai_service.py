@@ -1,9 +1,153 @@
 import os
 import json
+import hashlib
 import re
+import zlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import time
 import requests
+from llm_transport import PooledTransport
+from resilience import (CircuitBreaker, CancelToken, DeadlineExceeded, backoff_delay, bounded_timeout, cancel_scope,
+                        is_retryable, provider_slot, raise_if_cancelled, remaining_time)
+from intent_classifier import IntentClassifier, extract_entities
+from response_cache import ResponseCache, make_cache_key, normalize_message
+from facility_index import FacilityIndex
+from facility_answers import FacilityAnswers, question_kinds
+from cache_versions import FACILITIES, bump_version, read_version
+from model_routing import TASKS, router_from_env
+from admission import AdmissionController, UserRateLimiter
+from singleflight import SingleFlight
+from llm_metrics import error_outcome, mark_chat_mode, mark_truncated, metrics, timed_stage
+from sqlalchemy import event, func
+from werkzeug.local import LocalProxy
 # Assuming models.py is correctly defined and accessible
-from models import Facility, IssueType, Priority 
+from models import Facility, ChatMessage, IssueType, Priority 
+
+# Keyword sets used by the rule-based fallback, also the seed data for the local intent classifier
+FALLBACK_KEYWORDS = {
+    'computer_lab': ['computer', 'lab', 'pc', 'workstation'],
+    'library': ['library', 'book', 'study', 'reading'],
+    'gymnasium': ['gym', 'gymnasium', 'sports', 'exercise', 'fitness'],
+    'hostel': ['hostel', 'accommodation', 'dormitory', 'room'],
+    'cafeteria': ['cafeteria', 'food', 'dining', 'eat', 'meal'],
+    'location': ['where', 'location', 'find'],
+    'issue': ['problem', 'issue', 'broken', 'report', 'complaint'],
+    'booking': ['book', 'reserve', 'booking'],
+}
+
+# Keyword sets for facility types; the fallback answers them from matching facilities on record
+FALLBACK_TOPICS = ('computer_lab', 'library', 'gymnasium', 'hostel', 'cafeteria')
+
+# Intent each fallback keyword set implies when used as classifier training data
+FALLBACK_KEYWORD_INTENTS = {
+    'computer_lab': 'search',
+    'library': 'search',
+    'gymnasium': 'search',
+    'hostel': 'search',
+    'cafeteria': 'search',
+    'location': 'search',
+    'issue': 'report_issue',
+    'booking': 'book',
+}
+
+RESPONSE_GUIDANCE = """
+            Based on the above context, provide a helpful and conversational response.
+
+            - **search/explore intent:** Briefly describe the facility, its location, and primary purpose. If multiple match, list them briefly.
+            - **report_issue intent:** Acknowledge the issue, explain the reporting process (e.g., "Please use the 'Report Issue' function..."), and ask for more details if needed (e.g., exact location, severity).
+            - **book intent:** Provide booking information for the facility, or guide them to the booking system/process.
+            - **check_status intent:** Explain how to check the status of a reported issue (e.g., "You can check the status on your dashboard...").
+            - **general_info intent:** Provide general help, list available services, or ask clarifying questions.
+
+            Keep your response concise and directly answer the user's query if possible. If the requested information is not available in your knowledge base, politely state that.
+            """
+
+# Used by the combined (single round-trip) mode: the reply rules above plus the
+# intent/entity schema, returned together as one JSON object.
+COMBINED_GUIDANCE = RESPONSE_GUIDANCE + """
+            First classify the latest user message, then write your reply to it.
+            - Intent: One of [search, explore, book, report_issue, check_status, general_info]
+            - Facility: name of facility mentioned (if any); Location: specific location mentioned (if any)
+            - Issue_type: if reporting issue, one of [electrical, hygiene, structural, equipment, security, other]
+            - Component: specific component/equipment mentioned (if any), e.g., "projector", "toilet", "AC unit"
+
+            Your response must be a valid JSON object. Do not include any text before or after the JSON.
+            The JSON structure should be:
+            {
+                "intent": "intent_name",
+                "entities": {
+                    "facility": "facility_name or null",
+                    "location": "location or null",
+                    "issue_type": "issue_type or null",
+                    "component": "component or null"
+                },
+                "confidence": 0.0-1.0,
+                "response": "your reply to the user"
+            }
+            """
+
+# Parallel mode writes its reply before the intent is known. Such replies are
+# cached under this pseudo-intent, which no classification ever produces, so
+# they are never served to a turn that asked with a real intent.
+SPECULATIVE_INTENT = {"intent": "speculative", "entities": {}}
+
+# extract_entities_and_intent: the caller has not run the local classifier yet
+_NOT_CLASSIFIED = object()
+
+class ThinkTagFilter:
+    """
+    Incrementally strips <think>...</think> blocks from streamed model output.
+    Tags may be split across chunks, so any trailing text that could be the
+    start of a tag is held back until the next chunk decides it.
+    """
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+
+    @staticmethod
+    def _partial_tag_length(text: str, tag: str) -> int:
+        """Length of the longest suffix of text that is a proper prefix of tag."""
+        for length in range(min(len(text), len(tag) - 1), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the text that is safe to show so far."""
+        self.buffer += chunk
+        output = []
+        while self.buffer:
+            if self.in_think:
+                end = self.buffer.find(self.CLOSE_TAG)
+                if end == -1:
+                    # Drop hidden text but keep a possible partial closing tag
+                    keep = self._partial_tag_length(self.buffer, self.CLOSE_TAG)
+                    self.buffer = self.buffer[len(self.buffer) - keep:] if keep else ""
+                    break
+                self.buffer = self.buffer[end + len(self.CLOSE_TAG):]
+                self.in_think = False
+            else:
+                start = self.buffer.find(self.OPEN_TAG)
+                if start == -1:
+                    keep = self._partial_tag_length(self.buffer, self.OPEN_TAG)
+                    output.append(self.buffer[:len(self.buffer) - keep])
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                output.append(self.buffer[:start])
+                self.buffer = self.buffer[start + len(self.OPEN_TAG):]
+                self.in_think = True
+        return "".join(output)
+
+    def flush(self) -> str:
+        """Return any held-back visible text once the stream has ended."""
+        remaining = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return remaining
 
 class AIService:
     timeout = 60
@@ -13,8 +157,97 @@ class AIService:
         self.deepseek_url = os.environ.get("DEEPSEEK_API_URL", "https://openrouter.ai/api/v1/chat/completions")
         self.deepseek_model = os.environ.get("DEEPSEEK_MODEL", "deepseek/deepseek-chat-v3-0324:free")
         self.deepseek_key = os.environ.get("DEEPSEEK_API_KEY", None)  # Optional, if your API requires a key
+        # Per-task model routing (LLM_INTENT_*, LLM_CLASSIFY_*, LLM_RESPOND_*), defaulting to the settings above
+        self.model_routers = {
+            task: router_from_env(task, self.deepseek_url, self.deepseek_model, self.deepseek_key)
+            for task in TASKS
+        }
+        # Chat pipeline mode: "two_call" (intent extraction, then generation),
+        # "combined" (one structured call returns both), "parallel" (both calls at
+        # once, intent attached when it arrives) or "ab" (two_call/combined split by chat session)
+        self.chat_mode = os.environ.get("CHAT_MODE", "two_call").lower()
+        self.ab_combined_ratio = float(os.environ.get("CHAT_AB_COMBINED_RATIO", "0.5"))
+        # Local intent classifier: answers confident cases without an LLM round trip
+        self.intent_model_path = os.environ.get("INTENT_MODEL_PATH", os.path.join("instance", "intent_model.json"))
+        self.intent_fast_path_threshold = float(os.environ.get("INTENT_FAST_PATH_THRESHOLD", "0.85"))
+        self.intent_classifier = None
+        if os.environ.get("INTENT_FAST_PATH", "1") != "0":
+            self.load_intent_classifier()
+        self._stats_lock = threading.Lock()
+        self.intent_fast_path_hits = 0
+        self.intent_llm_calls = 0
+        # Cache of LLM replies keyed on normalized message + intent/entities
+        self.response_cache_enabled = os.environ.get("RESPONSE_CACHE_ENABLED", "1") != "0"
+        self.response_cache = ResponseCache(
+            max_size=int(os.environ.get("RESPONSE_CACHE_SIZE", "512")),
+            ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+        )
+        # Identical intent/reply calls already in flight in this worker are joined, not repeated;
+        # followers wait at most LLM_COALESCE_WAIT seconds before making their own call
+        self.llm_coalesce = os.environ.get("LLM_COALESCE", "1") != "0"
+        self.singleflight = SingleFlight(wait_timeout=float(os.environ.get("LLM_COALESCE_WAIT", "10")))
+        # Keep-alive connection pool shared by all request threads in this worker
+        self.transport = PooledTransport(read_timeout=float(os.environ.get("LLM_READ_TIMEOUT", self.timeout)))
+        # Failure handling: 429/5xx are retried with jittered backoff inside the request's
+        # deadline; repeated failures open the circuit and callers go straight to the fallback
+        self.llm_max_retries = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+        self.llm_retry_base_delay = float(os.environ.get("LLM_RETRY_BASE_DELAY", "0.5"))
+        self.llm_retry_max_delay = float(os.environ.get("LLM_RETRY_MAX_DELAY", "4"))
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+            recovery_timeout=float(os.environ.get("LLM_BREAKER_RECOVERY", "30"))
+        )
+        self.llm_retries = 0
+        # Ask providers for JSON output on the JSON tasks (set 0 if a model rejects response_format)
+        self.llm_json_mode = os.environ.get("LLM_JSON_MODE", "1") != "0"
+        # At most this many provider calls in flight from this process, whatever the chat mode
+        self.llm_max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", 0) or self.transport.pool_size)
+        self.llm_semaphore = threading.BoundedSemaphore(self.llm_max_concurrency)
+        # Pool running intent extraction alongside reply generation in parallel mode
+        self.parallel_pool_size = int(os.environ.get("PARALLEL_POOL_SIZE", 0) or os.environ.get("GUNICORN_THREADS", 0) or 2)
+        self._parallel_executor = None
+        self.parallel_turns = 0
+        self.parallel_intent_timeouts = 0
+        # Total time one chat request may spend on LLM calls, shared by all of them
+        self.request_deadline = float(os.environ.get("LLM_REQUEST_DEADLINE", "25"))
+        # A streamed reply only needs its first token within that deadline; after that
+        # it may run this long in total (pauses between chunks are bounded by the read timeout)
+        self.stream_max_seconds = float(os.environ.get("LLM_STREAM_MAX_SECONDS", "120"))
+        # Load shedding for the chat endpoints: at most CHAT_MAX_ACTIVE turns at once per worker
+        # (default: half the request threads, so booking and issue pages stay responsive), a short
+        # wait queue, then shed with HTTP 429 or the rule-based answer (CHAT_SHED_MODE)
+        threads = int(os.environ.get("GUNICORN_THREADS", "1") or 1)
+        self.admission = AdmissionController(
+            max_active=int(os.environ.get("CHAT_MAX_ACTIVE") or max(1, threads // 2)),
+            max_waiting=int(os.environ.get("CHAT_QUEUE_SIZE", "2")),
+            wait_timeout=float(os.environ.get("CHAT_QUEUE_TIMEOUT", "2"))
+        )
+        self.chat_shed_mode = os.environ.get("CHAT_SHED_MODE", "fallback").lower()
+        # Per-student token bucket: CHAT_RATE_BURST messages at once, refilled at CHAT_RATE_PER_MINUTE
+        self.user_rate_limiter = UserRateLimiter(
+            rate_per_minute=float(os.environ.get("CHAT_RATE_PER_MINUTE", "12")),
+            burst=int(os.environ.get("CHAT_RATE_BURST", "5"))
+        )
+        # Save each reply's LLM latency, token counts and outcomes on its ChatMessage row
+        self.persist_llm_stats = os.environ.get("LLM_STATS_PERSIST", "1") != "0"
+        # Conversation history budget: recent turns verbatim, older turns in a rolling summary
+        self.history_verbatim_turns = int(os.environ.get("HISTORY_VERBATIM_TURNS", "4"))
+        self.history_summary_batch = int(os.environ.get("HISTORY_SUMMARY_BATCH", "4"))
+        self.summary_max_tokens = int(os.environ.get("SUMMARY_MAX_TOKENS", "250"))
+        self.max_prompt_tokens = int(os.environ.get("MAX_PROMPT_TOKENS", "3000"))
+        # Number of relevance-ranked facilities included in each prompt
+        self.facility_context_k = int(os.environ.get("FACILITY_CONTEXT_K", "8"))
         self.facilities_cache = None
-        self.load_facilities()
+        self.facility_index = FacilityIndex([])
+        # Factual facility lookups (where, hours, booking, capacity, contact) are answered
+        # from the facility data by templates, without an LLM call
+        self.structured_answers_enabled = os.environ.get("STRUCTURED_ANSWERS", "1") != "0"
+        self.facility_answers = FacilityAnswers([])
+        # Facility data changed by any worker bumps a version row; this worker
+        # compares it at most once per interval and reloads when it moved on
+        self.facility_version_check_interval = float(os.environ.get("FACILITY_VERSION_CHECK_INTERVAL", "5"))
+        self.facilities_version = None
+        self._facilities_checked_at = 0.0
     
     def load_facilities(self):
         """Load facilities from database for context"""
@@ -23,22 +256,188 @@ class AIService:
             # if AIService is initialized before app/db. This is a common pattern.
             from flask_app import app, db 
             with app.app_context():
+                # Read the version first: a change committed after this point bumps it again
+                version = read_version(db.session.connection(), FACILITIES)
                 facilities = Facility.query.all()
-                self.facilities_cache = [
+                facilities_cache = [
                     {
+                        'id': f.id,
                         'name': f.name,
                         'category': f.category,
                         'location': f.location,
                         'description': f.description or '',
-                        'is_bookable': f.is_bookable
+                        'is_bookable': f.is_bookable,
+                        'is_active': f.is_active is not False,
+                        'capacity': f.capacity,
+                        'operating_hours': f.operating_hours,
+                        'contact_info': f.contact_info
                     }
                     for f in facilities
                 ]
-            print(f"Loaded {len(self.facilities_cache)} facilities into cache.")
+            # Publish the index before the cache so readers never see a newer cache with an older index
+            self.facility_index = FacilityIndex(facilities_cache)
+            self.facility_answers = FacilityAnswers(facilities_cache)
+            self.facilities_cache = facilities_cache
+            self.facilities_version = version
+            self._facilities_checked_at = time.monotonic()
+            print(f"Loaded {len(self.facilities_cache)} facilities into cache (version {version}).")
         except Exception as e:
             print(f"Error loading facilities: {e}")
+            self.facility_index = FacilityIndex([])
+            self.facility_answers = FacilityAnswers([])
             self.facilities_cache = []
+
+    def ensure_facilities(self):
+        """
+        Load the facility cache on first use, and reload it (clearing cached
+        replies) when the stored facilities version shows another worker or
+        an admin changed facility data. The version is read at most once per
+        FACILITY_VERSION_CHECK_INTERVAL seconds, not on every chat turn.
+        """
+        now = time.monotonic()
+        if self.facilities_cache is not None and now - self._facilities_checked_at >= self.facility_version_check_interval:
+            self._facilities_checked_at = now
+            try:
+                from flask_app import app, db
+                with app.app_context():
+                    version = read_version(db.session.connection(), FACILITIES)
+                if version != self.facilities_version:
+                    print(f"Facilities changed (version {self.facilities_version} -> {version}); reloading cache.")
+                    self.invalidate_facility_data()
+            except Exception as e:
+                print(f"Error checking facilities version: {e}")
+        if self.facilities_cache is None:
+            self.load_facilities()
+
+    def relevant_facilities(self, user_message: str, entities=None, user_context=None) -> list:
+        """
+        Rank facilities against the message (plus any extracted facility/location
+        and the previous user turn, for follow-ups like "when does it open?")
+        and return the top FACILITY_CONTEXT_K for the prompt.
+        """
+        query_parts = [user_message]
+        if isinstance(entities, dict):
+            query_parts += [entities.get('facility') or '', entities.get('location') or '']
+        history = (user_context or {}).get('history') or []
+        previous_user_turns = [m.get('text', '') for m in history if m.get('sender') == 'user']
+        if previous_user_turns:
+            query_parts.append(previous_user_turns[-1])
+        return self.facility_index.top_k(" ".join(query_parts), self.facility_context_k)
     
+    def invalidate_facility_data(self):
+        """Forget cached replies and facility context after facility data changed"""
+        self.response_cache.clear()
+        self.facilities_cache = None # Reloaded lazily on next use
+
+    def warm_response_cache(self, top_n: int):
+        """Pre-answer the most frequent user messages so their first ask is a cache hit"""
+        from flask_app import app, db
+        with app.app_context():
+            rows = db.session.query(ChatMessage.message, func.count(ChatMessage.id).label("asked"))\
+                             .filter(ChatMessage.is_user == True)\
+                             .group_by(ChatMessage.message)\
+                             .order_by(func.count(ChatMessage.id).desc())\
+                             .limit(top_n).all()
+        warmed = 0
+        for message, _ in rows:
+            intent_data = self.extract_entities_and_intent(message)
+            self.generate_response(message, intent_data)
+            warmed += 1
+        print(f"Response cache warm-up answered {warmed} frequent messages.")
+
+    def start_cache_warmup(self, top_n: int):
+        """Run the warm-up in a background thread so startup is not delayed"""
+        if top_n > 0 and self.response_cache_enabled:
+            threading.Thread(target=self.warm_response_cache, args=(top_n,), name="response-cache-warmup", daemon=True).start()
+
+    def load_intent_classifier(self):
+        """Load the offline-trained intent model, if one has been trained"""
+        try:
+            self.intent_classifier = IntentClassifier.load(self.intent_model_path)
+            if self.intent_classifier:
+                print(f"Loaded intent classifier from {self.intent_model_path}.")
+        except Exception as e:
+            print(f"Error loading intent classifier: {e}")
+            self.intent_classifier = None
+
+    def _fast_path_intent(self, user_message: str):
+        """
+        Classify locally and return intent data when the model is confident
+        enough, otherwise None so the caller asks the LLM.
+        """
+        if not self.intent_classifier:
+            return None
+        self.ensure_facilities()
+        intent, confidence = self.intent_classifier.predict(user_message)
+        if confidence < self.intent_fast_path_threshold:
+            return None
+        facility_names = [f['name'] for f in self.facilities_cache or []]
+        return {
+            "intent": intent,
+            "entities": extract_entities(user_message, facility_names),
+            "confidence": round(confidence, 3),
+            "source": "local"
+        }
+
+    def get_stats(self) -> dict:
+        """Runtime counters for the admin stats endpoint"""
+        with self._stats_lock:
+            hits, llm_calls = self.intent_fast_path_hits, self.intent_llm_calls
+        total = hits + llm_calls
+        return {
+            "chat_mode": self.chat_mode,
+            "facilities_cached": len(self.facilities_cache or []),
+            "facilities_version": self.facilities_version,
+            "intent_fast_path": {
+                "enabled": self.intent_classifier is not None,
+                "threshold": self.intent_fast_path_threshold,
+                "hits": hits,
+                "llm_calls": llm_calls,
+                "hit_rate": round(hits / total, 3) if total else None,
+            },
+            "response_cache": dict(self.response_cache.stats(), enabled=self.response_cache_enabled),
+            "transport": self.transport.stats(),
+            "models": {task: router.stats() for task, router in self.model_routers.items()},
+            "circuit_breaker": self.breaker.stats(),
+            "llm_max_concurrency": self.llm_max_concurrency,
+            "admission": dict(self.admission.stats(), shed_mode=self.chat_shed_mode),
+            "user_rate_limit": self.user_rate_limiter.stats(),
+            "coalescing": dict(self.singleflight.stats(), enabled=self.llm_coalesce),
+            "parallel": {
+                "pool_size": self.parallel_pool_size,
+                "turns": self.parallel_turns,
+                "intent_timeouts": self.parallel_intent_timeouts,
+            },
+            "llm_retries": self.llm_retries,
+        }
+
+    def prometheus_metrics(self) -> str:
+        """LLM call and pipeline stage metrics plus the main runtime counters, for /metrics"""
+        with self._stats_lock:
+            hits, llm_calls = self.intent_fast_path_hits, self.intent_llm_calls
+        cache = self.response_cache.stats()
+        breaker = self.breaker.stats()
+        admission = self.admission.stats()
+        coalescing = self.singleflight.stats()
+        return metrics.render([
+            ("llm_circuit_open", "gauge", "1 while the LLM circuit breaker is open", int(breaker["state"] == "open")),
+            ("llm_circuit_trips_total", "counter", "Times the circuit breaker opened", breaker["trips"]),
+            ("llm_circuit_rejected_total", "counter", "Calls rejected while the circuit was open", breaker["rejected_calls"]),
+            ("chat_active_turns", "gauge", "Chat turns running in this worker", admission["active"]),
+            ("chat_waiting_turns", "gauge", "Chat turns waiting for admission", admission["waiting"]),
+            ("chat_shed_total", "counter", "Chat turns shed by admission control", admission["shed"]),
+            ("chat_rate_limited_total", "counter", "Chat messages refused by the per-user rate limit",
+             self.user_rate_limiter.stats()["limited"]),
+            ("llm_coalesced_total", "counter", "LLM calls answered by an identical call in flight", coalescing["coalesced"]),
+            ("llm_coalesce_wait_timeouts_total", "counter", "Coalesced callers that gave up waiting and called the LLM",
+             coalescing["wait_timeouts"]),
+            ("response_cache_hits_total", "counter", "Response cache hits", cache["hits"]),
+            ("response_cache_misses_total", "counter", "Response cache misses", cache["misses"]),
+            ("intent_fast_path_hits_total", "counter", "Intents answered by the local classifier", hits),
+            ("intent_llm_calls_total", "counter", "Intents that needed an LLM call", llm_calls),
+            ("facilities_cache_version", "gauge", "Facility data version this worker has loaded", self.facilities_version or 0),
+        ])
+
     def _remove_think_tags(self, text: str) -> str:
         """Remove <think>...</think> tags and their content from the model response."""
         return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
@@ -59,16 +458,478 @@ class AIService:
 
         return json.loads(json_string)
 
-    def extract_entities_and_intent(self, user_message: str) -> dict:
-        """Extract entities and classify intent from user message using AI"""
-        # Ensure facilities_cache is loaded
-        if self.facilities_cache is None:
-            self.load_facilities()
+    def _post(self, url: str, payload: dict, headers: dict, stream: bool = False,
+              task: str = "respond") -> requests.Response:
+        """
+        POST to the LLM endpoint through the circuit breaker. 429/5xx responses,
+        connection errors and timeouts are retried with jittered exponential
+        backoff, and every attempt is clipped to the request's deadline.
+        Raises CircuitOpenError immediately while the circuit is open, and
+        RequestCancelled once the request's cancel token is set.
+        """
+        raise_if_cancelled()
+        self.breaker.before_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                raise_if_cancelled()
+                timeout = bounded_timeout(self.transport.connect_timeout, self.transport.read_timeout)
+                response = self.transport.post(url, json=payload, headers=headers,
+                                               timeout=timeout, stream=stream)
+                try:
+                    response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+                except requests.exceptions.HTTPError:
+                    response.close()
+                    raise
+                self.breaker.record_success()
+                return response
+            except requests.exceptions.RequestException as e:
+                if not is_retryable(e):
+                    if isinstance(e, DeadlineExceeded):
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.release() # e.g. 400/401: a caller problem, not an outage
+                    raise
+                delay = backoff_delay(attempt, self.llm_retry_base_delay, self.llm_retry_max_delay)
+                retry_after = e.response.headers.get("Retry-After") if getattr(e, "response", None) is not None else None
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                remaining = remaining_time()
+                if attempt > self.llm_max_retries or (remaining is not None and remaining <= delay):
+                    self.breaker.record_failure()
+                    raise
+                print(f"LLM call failed ({e}); retry {attempt} of {self.llm_max_retries} in {delay:.2f}s")
+                with self._stats_lock:
+                    self.llm_retries += 1
+                metrics.count_retry(task, payload.get("model"))
+                time.sleep(delay)
+
+    def _call_llm(self, messages: list, temperature: float, max_tokens: int, task: str = "respond",
+                  json_mode: bool = False) -> str:
+        """
+        Send a chat completion request to the model configured for `task` and
+        return the raw text content of the first choice. The provider adapter
+        turns max_tokens, temperature and JSON mode into the fields that
+        provider honours.
+        """
+        router = self.model_routers[task]
+        config = router.choose()
+        adapter = config.adapter
+        payload = adapter.build_payload(
+            config.model, messages, temperature=temperature, max_tokens=config.token_cap(max_tokens),
+            json_mode=json_mode and self.llm_json_mode, stream=False
+        )
+        started = time.perf_counter()
+        outcome = "error"
+        content = ""
+        first_byte = None
+        prompt_tokens = completion_tokens = None
+        try:
+            if adapter.local:
+                content = adapter.complete(payload)
+            else:
+                with provider_slot(self.llm_semaphore):
+                    response = self._post(config.url, payload, adapter.headers(config.key), task=task)
+                first_byte = response.elapsed.total_seconds() # Until the response headers arrived
+                data = response.json()
+                content = adapter.parse_response(data)
+                prompt_tokens, completion_tokens = adapter.parse_usage(data)
+            outcome = "ok"
+        except Exception as e:
+            outcome = error_outcome(e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            router.record(config, elapsed * 1000, outcome)
+            self._observe_call(task, config, messages, content, elapsed, first_byte,
+                               prompt_tokens, completion_tokens, outcome)
+        return content
+
+    def _stream_llm(self, messages: list, temperature: float, max_tokens: int, task: str = "respond"):
+        """Stream a chat completion and yield raw content deltas as they arrive"""
+        router = self.model_routers[task]
+        config = router.choose()
+        adapter = config.adapter
+        payload = adapter.build_payload(
+            config.model, messages, temperature=temperature, max_tokens=config.token_cap(max_tokens),
+            stream=True
+        )
+        started = time.perf_counter()
+        outcome = "error"
+        first_byte = None
+        parts = []
+        try:
+            deltas = adapter.stream(payload) if adapter.local else self._stream_deltas(config, payload, task)
+            for delta in deltas:
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                parts.append(delta)
+                yield delta
+            outcome = "ok"
+        except GeneratorExit:
+            outcome = "cancelled" # The client went away mid-stream
+            raise
+        except Exception as e:
+            outcome = error_outcome(e)
+            raise
+        finally:
+            # Latency of the whole stream, so the SLO compares like with like
+            elapsed = time.perf_counter() - started
+            router.record(config, elapsed * 1000, outcome)
+            self._observe_call(task, config, messages, "".join(parts), elapsed, first_byte, None, None, outcome)
+
+    def _observe_call(self, task, config, messages, content, elapsed, first_byte,
+                      prompt_tokens, completion_tokens, outcome):
+        """Export one provider call; token counts the provider did not report are estimated"""
+        if prompt_tokens is None:
+            prompt_tokens = sum(self.estimate_tokens(m.get("content")) for m in messages)
+        if completion_tokens is None and content:
+            completion_tokens = self.estimate_tokens(content)
+        metrics.observe_call(task, config.model, elapsed, first_byte, prompt_tokens, completion_tokens, outcome)
+
+    def _stream_deltas(self, config, payload: dict, task: str = "respond"):
+        """
+        Yield content deltas from a streaming completion response. The request
+        deadline covers the connection and the first token; once the reply has
+        started it may stream for up to LLM_STREAM_MAX_SECONDS.
+        """
+        adapter = config.adapter
+        streaming_since = None
+        with provider_slot(self.llm_semaphore), \
+                self._post(config.url, payload, adapter.headers(config.key), stream=True, task=task) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                raise_if_cancelled()
+                content, finished = adapter.parse_stream_line(line)
+                if content:
+                    if streaming_since is None:
+                        streaming_since = time.monotonic()
+                    yield content
+                if streaming_since is None:
+                    remaining = remaining_time()
+                    if remaining is not None and remaining <= 0:
+                        raise DeadlineExceeded("LLM deadline exceeded before the first token")
+                elif time.monotonic() - streaming_since > self.stream_max_seconds:
+                    raise DeadlineExceeded("LLM stream exceeded LLM_STREAM_MAX_SECONDS")
+                if finished:
+                    break
+
+    def _coalesced(self, key, call):
+        """Run `call`, or wait for the identical call (same key) already in flight"""
+        if not self.llm_coalesce:
+            return call()
+        return self.singleflight.do(key, call)
+
+    @staticmethod
+    def _payload_digest(messages: list) -> str:
+        """Coalescing key for a prompt: identical messages, in order"""
+        return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+    def _normalize_intent_result(self, result: dict) -> dict:
+        """Apply default values to a parsed intent/entities JSON object."""
+        extracted_entities = result.get("entities") or {}
+        return {
+            "intent": result.get("intent") or "general_info",
+            "entities": {
+                "facility": extracted_entities.get("facility", None),
+                "location": extracted_entities.get("location", None),
+                "issue_type": extracted_entities.get("issue_type", None),
+                "component": extracted_entities.get("component", None)
+            },
+            "confidence": result.get("confidence", 0.0), # Model might not always provide this
+            "source": "llm"
+        }
+
+    def _history_messages(self, user_context) -> list:
+        """Convert chat history (and the rolling summary, if any) into LLM chat messages."""
+        messages = []
+        if user_context and user_context.get('summary'):
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {user_context['summary']}"})
+        if user_context and user_context.get('history'):
+            for msg in user_context['history']:
+                messages.append({"role": msg['sender'].replace("bot","assistant"), "content": msg['text']})
+        return messages
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Cheap token estimate (about 4 characters per token for English text)"""
+        return len(text or "") // 4 + 1
+
+    def budget_history(self, chat_session) -> dict:
+        """
+        Load a bounded window of the session's stored messages. The last
+        HISTORY_VERBATIM_TURNS turns are kept verbatim and older messages are
+        folded into the rolling summary stored on the ChatSession, in batches of
+        HISTORY_SUMMARY_BATCH. Each fold only sends the new messages plus the
+        previous summary, so the cost per turn stays flat. The caller commits
+        chat_session together with the new chat messages.
+        Returns a user_context dict with 'summary' and 'history'.
+        """
+        session_messages = ChatMessage.query.filter_by(session_id=chat_session.id)
+        total = session_messages.count()
+        folded = min(chat_session.summarized_count or 0, total)
+
+        verbatim_messages = self.history_verbatim_turns * 2  # One turn is a user message plus a reply
+        overflow = max(0, total - verbatim_messages - folded)
+        if overflow >= self.history_summary_batch:
+            older = session_messages.order_by(ChatMessage.timestamp, ChatMessage.id)\
+                                    .offset(folded).limit(overflow).all()
+            chat_session.summary = self._update_summary(chat_session.summary, self._as_history(older))
+            chat_session.summarized_count = folded + overflow
+            folded = chat_session.summarized_count
+
+        # Newest first via the (session_id, timestamp) index, then back to chronological order
+        recent = session_messages.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())\
+                                 .limit(total - folded).all()
+        return {'summary': chat_session.summary, 'history': self._as_history(reversed(recent))}
+
+    @staticmethod
+    def _as_history(chat_messages) -> list:
+        """Convert ChatMessage rows into the {'sender', 'text'} history format"""
+        return [{'sender': 'user' if m.is_user else 'bot', 'text': m.message} for m in chat_messages]
+
+    @timed_stage("summary")
+    def _update_summary(self, previous_summary: str, messages: list) -> str:
+        """Fold new messages into the running summary, falling back to an extractive summary"""
+        max_chars = self.summary_max_tokens * 4
+        transcript = "\n".join(f"{m.get('sender', 'user')}: {m.get('text', '')}" for m in messages)
+        try:
+            prompt = f"""
+            Current summary of the conversation so far:
+            {previous_summary or "(none)"}
+
+            New messages:
+            {transcript}
+
+            Update the summary to include the new messages. Keep facility names, locations,
+            reported problems and anything the student asked to be remembered.
+            Reply with the updated summary only, in at most {self.summary_max_tokens // 2} words.
+            """
+            summary = self._call_llm(
+                [
+                    {"role": "system", "content": "You maintain short running summaries of campus assistant conversations."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.2,
+                max_tokens=self.summary_max_tokens
+            )
+            summary = self._remove_think_tags(summary).strip()
+            if not summary:
+                raise ValueError("Model returned an empty summary.")
+        except Exception as e:
+            print(f"Error updating conversation summary: {e}")
+            metrics.count_outcome("summary", "fallback")
+            lines = [f"{m.get('sender', 'user')}: {m.get('text', '')[:120]}" for m in messages]
+            summary = " ".join(filter(None, [previous_summary, " | ".join(lines)]))
+        # Keep the most recent part if the summary outgrows its budget
+        return summary[-max_chars:]
+
+    def _fit_to_budget(self, fixed_messages: list, history_messages: list) -> list:
+        """
+        Drop the oldest history messages (then trim the summary) until the
+        whole prompt fits MAX_PROMPT_TOKENS.
+        """
+        budget = self.max_prompt_tokens - sum(self.estimate_tokens(m['content']) for m in fixed_messages)
+        history_messages = list(history_messages)
+        has_summary = bool(history_messages) and history_messages[0]['content'].startswith("Summary of the earlier conversation")
+        first_droppable = 1 if has_summary else 0
+        while history_messages and sum(self.estimate_tokens(m['content']) for m in history_messages) > budget:
+            if len(history_messages) > first_droppable:
+                history_messages.pop(first_droppable)
+            else:
+                remaining_chars = max(0, budget) * 4
+                if remaining_chars < 80:
+                    history_messages = []
+                else:
+                    history_messages[0] = dict(history_messages[0], content=history_messages[0]['content'][:remaining_chars])
+                break
+        return history_messages
+
+    def resolve_chat_mode(self, session_key: str = None) -> str:
+        """
+        Return the pipeline mode for a chat turn. In "ab" mode the choice is
+        stable per chat session so a conversation never switches arms.
+        """
+        if self.chat_mode == "ab":
+            bucket = (zlib.crc32((session_key or "").encode("utf-8")) % 1000) / 1000.0
+            return "combined" if bucket < self.ab_combined_ratio else "two_call"
+        if self.chat_mode in ("combined", "parallel"):
+            return self.chat_mode
+        return "two_call"
+
+    def process_message(self, user_message: str, user_context=None) -> tuple:
+        """
+        Run the chat pipeline for one user message.
+        Returns (intent_data, response_text) regardless of the mode used.
+        """
+        session_key = (user_context or {}).get('session_id')
+        mode = self.resolve_chat_mode(session_key)
+        mark_chat_mode(mode) # Stored with the turn's llm_stats, so A/B arms can be compared per message
+        if mode == "combined":
+            return self.extract_and_respond(user_message, user_context=user_context)
+        if mode == "parallel":
+            return self.process_message_parallel(user_message, user_context=user_context)
+
+        intent_data = self.extract_entities_and_intent(user_message)
+        bot_response = self.generate_response(user_message, intent_data, user_context=user_context)
+        return intent_data, bot_response
+
+    @timed_stage("template")
+    def structured_answer(self, user_message: str):
+        """
+        Answer a factual facility lookup straight from the facility cache.
+        Returns (intent_data, response_text), or None when the message is
+        open-ended, reports a problem or names no single facility, so it
+        needs the LLM.
+        """
+        if not self.structured_answers_enabled:
+            return None
+        kinds = question_kinds(user_message)
+        if not kinds or any(word in user_message.lower() for word in FALLBACK_KEYWORDS['issue']):
+            return None # Not a lookup, or reporting a problem
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
+        entities = extract_entities(user_message, [f['name'] for f in self.facilities_cache or []])
+        facility = self.facility_answers.resolve(user_message, entities)
+        if facility is None:
+            return None
+        entities['facility'] = facility['name']
+        metrics.count_outcome("template", "answered")
+        intent_data = {
+            "intent": "book" if kinds == ["booking"] else "search",
+            "entities": entities,
+            "confidence": 1.0,
+            "source": "template"
+        }
+        return intent_data, self.facility_answers.render(facility, kinds)
+
+    def shed_message(self, user_message: str) -> tuple:
+        """
+        Answer a turn that admission control turned away, without any LLM call:
+        local intent if the classifier is confident, rule-based reply.
+        """
+        metrics.count_outcome("admission", "shed")
+        intent_data = self._fast_path_intent(user_message) or \
+            {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": "Shed"}
+        return intent_data, self._generate_fallback_response(user_message, intent_data)
+
+    def _intent_executor(self) -> ThreadPoolExecutor:
+        """Thread pool for parallel mode, created on first use (so after any fork)"""
+        if self._parallel_executor is None:
+            with self._stats_lock:
+                if self._parallel_executor is None:
+                    self._parallel_executor = ThreadPoolExecutor(max_workers=self.parallel_pool_size,
+                                                                 thread_name_prefix="intent")
+        return self._parallel_executor
+
+    def process_message_parallel(self, user_message: str, user_context=None) -> tuple:
+        """
+        Parallel mode: extract the intent on the pool while the reply is written
+        from the message and the retrieved facilities alone, then attach the
+        intent when it arrives. A turn takes max(intent, reply) instead of their
+        sum. The request's deadline and cancel token travel with the pool task;
+        if the intent is still missing when the deadline passes, the task is
+        cancelled and the default intent is used.
+        """
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
+        local_result = self._fast_path_intent(user_message)
+        if local_result is not None:
+            # The intent is known locally in microseconds, so there is nothing to overlap
+            intent_data = self.extract_entities_and_intent(user_message, local_result)
+            return intent_data, self.generate_response(user_message, intent_data, user_context=user_context)
+
+        cache_key = make_cache_key(user_message, SPECULATIVE_INTENT, user_context)
+        if self.response_cache_enabled:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                # Only the intent is left to find out
+                metrics.count_outcome("respond", "cache_hit")
+                return self.extract_entities_and_intent(user_message, None), cached
+
+        with self._stats_lock:
+            self.parallel_turns += 1
+        token = CancelToken()
+        with cancel_scope(token):
+            # copy_context() carries the deadline and cancel token into the pool thread
+            future = self._intent_executor().submit(contextvars.copy_context().run,
+                                                    self.extract_entities_and_intent, user_message, None)
+            try:
+                reply = self._generate_speculative_reply(user_message, user_context)
+                remaining = remaining_time()
+                try:
+                    intent_data = future.result(timeout=None if remaining is None else max(0, remaining))
+                except FutureTimeout:
+                    future.cancel()
+                    with self._stats_lock:
+                        self.parallel_intent_timeouts += 1
+                    metrics.count_outcome("intent", "timeout")
+                    intent_data = {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": "Timeout"}
+            finally:
+                token.cancel() # Nothing left over from this request may still reach the provider
+
+        if reply is None:
+            return intent_data, self._respond_fallback(user_message, intent_data)
+        if self.response_cache_enabled:
+            self.response_cache.set(cache_key, reply)
+        return intent_data, reply
+
+    @timed_stage("respond")
+    def _generate_speculative_reply(self, user_message: str, user_context=None):
+        """Write the reply before the intent is known; returns None if the LLM call failed"""
+        try:
+            messages = self._build_response_messages(user_message, "not yet determined", "not yet determined", user_context)
+            # Coalesced on the whole prompt, like generate_response
+            model_raw_content = self._coalesced(
+                ("respond", self._payload_digest(messages)),
+                lambda: self._call_llm(messages, temperature=0.7, max_tokens=500)
+            )
+            reply = self._remove_think_tags(model_raw_content or "").strip()
+            if not reply:
+                raise ValueError("Model returned empty response content for generation.")
+            metrics.count_outcome("respond", "success")
+            return reply
+        except requests.exceptions.Timeout:
+            print(f"Error in parallel response generation: Request timed out.")
+            metrics.count_outcome("respond", "timeout")
+        except requests.exceptions.RequestException as e:
+            print(f"Error communicating with LLM API for parallel response generation: {e}")
+            metrics.count_outcome("respond", "api_error")
+        except ValueError as e:
+            print(f"Parallel response generation error: {e}")
+            metrics.count_outcome("respond", "model_output_error")
+        except Exception as e:
+            print(f"An unexpected error occurred during parallel response generation: {e}")
+            metrics.count_outcome("respond", "unexpected_error")
+        return None
 
+    @timed_stage("intent")
+    def extract_entities_and_intent(self, user_message: str, local_result=_NOT_CLASSIFIED) -> dict:
+        """
+        Extract entities and classify intent from user message using AI.
+        Callers that already ran _fast_path_intent pass its result (None if
+        it was not confident), so the local classifier does not run twice.
+        """
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
+
+        # Confident local prediction skips the LLM round trip entirely
+        if local_result is _NOT_CLASSIFIED:
+            local_result = self._fast_path_intent(user_message)
+        with self._stats_lock:
+            if local_result:
+                self.intent_fast_path_hits += 1
+            else:
+                self.intent_llm_calls += 1
+        if local_result:
+            metrics.count_outcome("intent", "fast_path")
+            return local_result
+
+        model_raw_content = ""
         try:
             facilities_context = "\n".join([
                 f"- {f['name']} ({f['category']}) at {f['location']}"
-                for f in self.facilities_cache[:20]  # Limit context size
+                for f in self.relevant_facilities(user_message)  # Only the facilities relevant to this message
             ])
             
             prompt = f"""
@@ -101,33 +962,15 @@ class AIService:
             }}
             """
             
-            headers = {"Authorization": f"Bearer {self.deepseek_key}"} if self.deepseek_key else {}
-
-            payload = {
-                "model": self.deepseek_model,
-                "messages": [
-                    {"role": "system", "content": "You are an expert in natural language processing for campus facility management. Always respond ONLY with valid JSON, strictly adhering to the specified schema. Do not include any conversational text or markdown code blocks (e.g., ```json)."},
-                    {"role": "user", "content": prompt}
-                ],
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": 300
-                },
-                "stream": False # Ensure full JSON response at once
-            }
-            response = requests.post(self.deepseek_url, json=payload, headers=headers, timeout=self.timeout) # Increased timeout
-            response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-            
-            result_data = response.json()
-
-            # Correctly access content from Ollama's /api/chat response
-            # model_raw_content = result_data.get("message", {}).get("content", "")
-
-            # For OpenRouter.ai: extract content from choices[0]['message']['content']
-            choices = result_data.get("choices", [])
-            model_raw_content = ""
-            if choices and "message" in choices[0]:
-                model_raw_content = choices[0]["message"].get("content", "")
+            messages = [
+                {"role": "system", "content": "You are an expert in natural language processing for campus facility management. Always respond ONLY with valid JSON, strictly adhering to the specified schema. Do not include any conversational text or markdown code blocks (e.g., ```json)."},
+                {"role": "user", "content": prompt}
+            ]
+            # Students asking the same thing at the same time share one LLM call
+            model_raw_content = self._coalesced(
+                ("intent", normalize_message(user_message)),
+                lambda: self._call_llm(messages, temperature=0.3, max_tokens=300, task="intent", json_mode=True)
+            )
 
             if not model_raw_content:
                 raise ValueError("Model returned empty content for entity & intent extraction.")
@@ -135,192 +978,313 @@ class AIService:
             result = self._extract_json_from_llm_response(model_raw_content)
 
             # Basic validation and default values
-            extracted_intent = result.get("intent", "general_info")
-            extracted_entities = result.get("entities", {})
-            extracted_confidence = result.get("confidence", 0.0) # Model might not always provide this
-
-            return {
-                "intent": extracted_intent,
-                "entities": {
-                    "facility": extracted_entities.get("facility", None),
-                    "location": extracted_entities.get("location", None),
-                    "issue_type": extracted_entities.get("issue_type", None),
-                    "component": extracted_entities.get("component", None)
-                },
-                "confidence": extracted_confidence
-            }
+            metrics.count_outcome("intent", "success")
+            return self._normalize_intent_result(result)
             
         except requests.exceptions.Timeout:
             print(f"Error in entity extraction: Request timed out.")
+            metrics.count_outcome("intent", "timeout")
             return {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": "Timeout"}
         except requests.exceptions.RequestException as e:
             print(f"Error communicating with Ollama API for entity extraction: {e}")
             print("Ensure 'ollama serve' is running and the model is available.")
+            metrics.count_outcome("intent", "api_error")
             return {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": f"API error: {e}"}
         except json.JSONDecodeError as e:
             print(f"Error parsing JSON from model response for entity extraction: {e}")
             print(f"Raw model content was: '{model_raw_content}'") # Important for debugging
+            metrics.count_outcome("intent", "json_error")
             return {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": f"JSON parse error: {e}"}
         except ValueError as e: # For "Model returned empty content"
             print(f"Entity extraction error: {e}")
+            metrics.count_outcome("intent", "model_output_error")
             return {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": f"Model output issue: {e}"}
         except Exception as e:
             print(f"An unexpected error occurred during entity extraction: {e}")
+            metrics.count_outcome("intent", "unexpected_error")
             return {"intent": "general_info", "entities": {}, "confidence": 0.0, "error": f"Unexpected error: {e}"}
     
-    def generate_response(self, user_message: str, intent_data: dict, user_context=None) -> str:
-        """Generate contextual response based on intent and entities"""
-        # Ensure facilities_cache is loaded
-        if self.facilities_cache is None:
-            self.load_facilities()
-
-        try:
-            intent = intent_data.get('intent', 'general_info')
-            entities = intent_data.get('entities', {})
-            
-            # Build context for the LLM
-            facilities_context = "\n".join([
-                f"- {f['name']} ({f['category']}) at {f['location']}" + 
-                (f" - Bookable" if f['is_bookable'] else "")
-                for f in self.facilities_cache[:15] # Limit context size
-            ])
-            
-            context_prompt = f"""
-            You are the UTM Campus Assistant Chatbot. Your goal is to provide helpful, friendly, and concise information to students regarding campus facilities.
+    def _build_response_messages(self, user_message: str, intent, entities, user_context=None, guidance: str = None) -> list:
+        """Build the system context, history and guidance messages for reply generation"""
+        # Build context for the LLM
+        facilities_context = "\n".join([
+            f"- {f['name']} ({f['category']}) at {f['location']}" + 
+            (f" - Bookable" if f['is_bookable'] else "")
+            for f in self.relevant_facilities(user_message, entities, user_context) # Only the facilities relevant to this message
+        ])
+        
+        context_prompt = f"""
+        You are the UTM Campus Assistant Chatbot. Your goal is to provide helpful, friendly, and concise information to students regarding campus facilities.
 
-            **Current Date and Time:** {os.getenv("CURRENT_TIME", "Unknown")}
-            **Campus Location:** Singapore, Singapore
+        **Current Date and Time:** {os.getenv("CURRENT_TIME", "Unknown")}
+        **Campus Location:** Singapore, Singapore
 
-            **Available Facilities Information:**
-            {facilities_context}
+        **Available Facilities Information:**
+        {facilities_context}
 
-            **Current User Input:** "{user_message}"
-            **Current Detected Intent:** {intent}
-            **Current Extracted Entities:** {entities}
-            """
-            
-            # Build conversation history if user_context is provided (for multi-turn)
-            messages = [
-                {"role": "system", "content": context_prompt},
-            ]
-            # If you want to maintain a longer conversation, you'd add past messages here
-            if user_context and user_context.get('history'):
-                for msg in user_context['history']:
-                    messages.append({"role": msg['sender'].replace("bot","assistant"), "content": msg['text']})
-            messages.append({"role": "user", "content": user_message})
-
-            # Add specific guidance for response generation based on intent
-            response_guidance = """
-            Based on the above context, provide a helpful and conversational response.
+        **Current User Input:** "{user_message}"
+        **Current Detected Intent:** {intent}
+        **Current Extracted Entities:** {entities}
+        """
+        
+        # Add specific guidance for response generation based on intent
+        system_message = {"role": "system", "content": context_prompt}
+        user_turn = {"role": "user", "content": user_message}
+        guidance_message = {"role": "system", "content": guidance or RESPONSE_GUIDANCE}
 
-            - **search/explore intent:** Briefly describe the facility, its location, and primary purpose. If multiple match, list them briefly.
-            - **report_issue intent:** Acknowledge the issue, explain the reporting process (e.g., "Please use the 'Report Issue' function..."), and ask for more details if needed (e.g., exact location, severity).
-            - **book intent:** Provide booking information for the facility, or guide them to the booking system/process.
-            - **check_status intent:** Explain how to check the status of a reported issue (e.g., "You can check the status on your dashboard...").
-            - **general_info intent:** Provide general help, list available services, or ask clarifying questions.
+        # Build conversation history if user_context is provided (for multi-turn),
+        # trimmed so the whole prompt stays under MAX_PROMPT_TOKENS
+        history_messages = self._fit_to_budget(
+            [system_message, user_turn, guidance_message],
+            self._history_messages(user_context)
+        )
+        return [system_message] + history_messages + [user_turn, guidance_message]
 
-            Keep your response concise and directly answer the user's query if possible. If the requested information is not available in your knowledge base, politely state that.
-            """
-            messages.append({"role": "system", "content": response_guidance}) # Add this as a guiding message
+    @timed_stage("respond")
+    def generate_response(self, user_message: str, intent_data: dict, user_context=None) -> str:
+        """Generate contextual response based on intent and entities"""
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
 
-            headers = {"Authorization": f"Bearer {self.deepseek_key}"} if self.deepseek_key else {}
+        cache_key = make_cache_key(user_message, intent_data, user_context)
+        if self.response_cache_enabled:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                metrics.count_outcome("respond", "cache_hit")
+                return cached
 
-            payload = {
-                "model": self.deepseek_model,
-                "messages": messages, # Use the built messages array
-                "options": {
-                    "temperature": 0.7, # Slightly higher temperature for more conversational responses
-                    "num_predict": 500  # Allow more tokens for the response
-                },
-                "stream": False # Get full response at once
-            }
-            
-            response = requests.post(self.deepseek_url, json=payload, headers=headers, timeout=self.timeout) # Increased timeout
-            response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
+        try:
+            intent = intent_data.get('intent', 'general_info')
+            entities = intent_data.get('entities', {})
             
-            result_data = response.json()
+            messages = self._build_response_messages(user_message, intent, entities, user_context)
 
-            # --- CRITICAL FIX: Correctly access the content from Ollama's chat API response ---
-            # Ollama's /api/chat returns: {"model": ..., "created_at": ..., "message": {"role": "assistant", "content": "..."}}
-            # Access directly via 'message' key.
-            # model_raw_content = result_data.get("message", {}).get("content", "").strip()
-
-            # For OpenRouter.ai: extract content from choices[0]['message']['content']
-            choices = result_data.get("choices", [])
-            model_raw_content = ""
-            if choices and "message" in choices[0]:
-                model_raw_content = choices[0]["message"].get("content", "")
+            # Slightly higher temperature and more tokens for conversational responses.
+            # Keyed on the whole prompt, so only calls with the same history and facts share one reply.
+            model_raw_content = self._coalesced(
+                ("respond", self._payload_digest(messages)),
+                lambda: self._call_llm(messages, temperature=0.7, max_tokens=500)
+            )
 
             if not model_raw_content:
                 raise ValueError("Model returned empty response content for generation.")
 
             # Remove <think>...</think> tags before returning to user
-            return self._remove_think_tags(model_raw_content).strip()
+            reply = self._remove_think_tags(model_raw_content).strip()
+            if self.response_cache_enabled:
+                self.response_cache.set(cache_key, reply) # Only model answers are cached, never fallbacks
+            metrics.count_outcome("respond", "success")
+            return reply
             
         except requests.exceptions.Timeout:
             print(f"Error generating response: Request timed out.")
-            return self._generate_fallback_response(user_message, intent_data)
+            metrics.count_outcome("respond", "timeout")
+            return self._respond_fallback(user_message, intent_data)
         except requests.exceptions.RequestException as e:
             print(f"Error communicating with Ollama API for response generation: {e}")
             print("Please ensure 'ollama serve' is running and the model is available.")
-            return self._generate_fallback_response(user_message, intent_data)
+            metrics.count_outcome("respond", "api_error")
+            return self._respond_fallback(user_message, intent_data)
         except ValueError as e: # For "Model returned empty content"
             print(f"Response generation error: {e}")
-            return self._generate_fallback_response(user_message, intent_data)
+            metrics.count_outcome("respond", "model_output_error")
+            return self._respond_fallback(user_message, intent_data)
         except Exception as e:
             print(f"An unexpected error occurred during response generation: {e}")
-            return self._generate_fallback_response(user_message, intent_data)
+            metrics.count_outcome("respond", "unexpected_error")
+            return self._respond_fallback(user_message, intent_data)
+
+    @timed_stage("respond")
+    def generate_response_stream(self, user_message: str, intent_data: dict, user_context=None):
+        """
+        Streaming variant of generate_response. Yields visible reply text as the
+        provider produces it, with <think> blocks removed across chunk boundaries.
+        Falls back to the rule-based answer if the stream fails before any output.
+        """
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
+
+        cache_key = make_cache_key(user_message, intent_data, user_context)
+        if self.response_cache_enabled:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                metrics.count_outcome("respond", "cache_hit")
+                yield cached
+                return
+
+        intent = intent_data.get('intent', 'general_info')
+        entities = intent_data.get('entities', {})
+        messages = self._build_response_messages(user_message, intent, entities, user_context)
+
+        think_filter = ThinkTagFilter()
+        produced_output = False
+        parts = []
+        try:
+            for delta in self._stream_llm(messages, temperature=0.7, max_tokens=500):
+                visible = think_filter.feed(delta)
+                if not produced_output:
+                    visible = visible.lstrip()
+                if visible:
+                    produced_output = True
+                    parts.append(visible)
+                    yield visible
+            tail = think_filter.flush()
+            if tail.strip() or (tail and produced_output):
+                produced_output = True
+                parts.append(tail)
+                yield tail
+            if not produced_output:
+                raise ValueError("Model returned empty response content for generation.")
+            if self.response_cache_enabled:
+                self.response_cache.set(cache_key, "".join(parts).strip())
+            metrics.count_outcome("respond", "success")
+
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            metrics.count_outcome("respond", "stream_error")
+            if not produced_output:
+                yield self._respond_fallback(user_message, intent_data)
+            else:
+                mark_truncated() # The student already has part of the reply; the caller flags it
+
+    @timed_stage("combined")
+    def extract_and_respond(self, user_message: str, user_context=None) -> tuple:
+        """
+        Combined mode: classify intent, extract entities and write the reply
+        with a single structured LLM call. Returns (intent_data, response_text).
+        """
+        # Ensure facilities_cache is loaded and current
+        self.ensure_facilities()
+
+        default_intent = {"intent": "general_info", "entities": {}, "confidence": 0.0}
+        model_raw_content = ""
+        try:
+            messages = self._build_response_messages(
+                user_message, "to be determined", "to be determined", user_context,
+                guidance=COMBINED_GUIDANCE
+            )
+            model_raw_content = self._call_llm(messages, temperature=0.5, max_tokens=700, json_mode=True)
+
+            if not model_raw_content:
+                raise ValueError("Model returned empty content for combined extraction and response.")
+
+            result = self._extract_json_from_llm_response(model_raw_content)
+            intent_data = self._normalize_intent_result(result)
+            reply = self._remove_think_tags(str(result.get("response") or "")).strip()
+            if not reply:
+                raise ValueError("Model returned JSON without a response field.")
+            metrics.count_outcome("combined", "success")
+            return intent_data, reply
+
+        except requests.exceptions.Timeout:
+            print(f"Error in combined chat call: Request timed out.")
+            metrics.count_outcome("combined", "timeout")
+            default_intent["error"] = "Timeout"
+        except requests.exceptions.RequestException as e:
+            print(f"Error communicating with LLM API for combined chat call: {e}")
+            metrics.count_outcome("combined", "api_error")
+            default_intent["error"] = f"API error: {e}"
+        except json.JSONDecodeError as e:
+            # The model answered in prose instead of JSON; keep the answer rather than discard it.
+            # Broken or truncated JSON (bare or in a code fence) must never reach the student.
+            print(f"Error parsing JSON from model response for combined chat call: {e}")
+            metrics.count_outcome("combined", "json_error")
+            default_intent["error"] = f"JSON parse error: {e}"
+            reply = self._remove_think_tags(model_raw_content).strip()
+            if reply and not reply.startswith(("{", "[", "`")):
+                return default_intent, reply
+        except ValueError as e:
+            print(f"Combined chat call error: {e}")
+            metrics.count_outcome("combined", "model_output_error")
+            default_intent["error"] = f"Model output issue: {e}"
+        except Exception as e:
+            print(f"An unexpected error occurred during combined chat call: {e}")
+            metrics.count_outcome("combined", "unexpected_error")
+            default_intent["error"] = f"Unexpected error: {e}"
+
+        return default_intent, self._generate_fallback_response(user_message, default_intent)
     
+    def _respond_fallback(self, user_message: str, intent_data: dict) -> str:
+        """The rule-based reply for a turn whose respond call failed, counted as respond:fallback"""
+        metrics.count_outcome("respond", "fallback")
+        return self._generate_fallback_response(user_message, intent_data)
+
     def _generate_fallback_response(self, user_message: str, intent_data: dict) -> str:
-        """Generate rule-based responses when AI generation fails or is unavailable."""
+        """
+        Generate rule-based responses when AI generation fails or is unavailable.
+        Everything about facilities comes from the facility cache, rendered by
+        the same templates as structured answers. Shed turns and failed combined
+        calls are counted by their own stages, not as respond:fallback.
+        """
         message_lower = user_message.lower()
         intent = intent_data.get('intent', 'general_info')
-        
-        # Computer lab queries
-        if any(word in message_lower for word in ['computer', 'lab', 'pc', 'workstation']):
-            return "🖥️ **Computer Lab 1** is located at **Block A, Level 2**. It has 40 workstations and is available for booking. You can use it for coursework and projects."
-        
-        # Library queries
-        if any(word in message_lower for word in ['library', 'book', 'study', 'reading']):
-            return "📚 The **Library** is located at **Block B, Ground Floor**. It's open from 8:00 AM to 10:00 PM and provides study spaces and resources for students."
-        
-        # Gymnasium queries
-        if any(word in message_lower for word in ['gym', 'gymnasium', 'sports', 'exercise', 'fitness']):
-            return "🏃 The **Gymnasium** is located at the **Sports Complex**. It's available for booking and hosts various sports activities and fitness programs."
-        
-        # Hostel queries
-        if any(word in message_lower for word in ['hostel', 'accommodation', 'dormitory', 'room']):
-            return "🏠 We have accommodation facilities:\n• **Male Hostel Block C** - Hostel Area\n• **Female Hostel Block D** - Hostel Area\n\nBoth provide student accommodation with necessary amenities."
-        
-        # Cafeteria queries
-        if any(word in message_lower for word in ['cafeteria', 'food', 'dining', 'eat', 'meal']):
-            return "🍽️ The **Cafeteria** is located at the **Student Center**. It's open from 7:00 AM to 9:00 PM and serves meals throughout the day."
-        
+        entities = intent_data.get('entities') or {}
+        # Ensure facilities_cache is available for fallback
+        if self.facilities_cache is None:
+            self.ensure_facilities()
+        facilities = [f for f in self.facilities_cache or [] if f.get('is_active', True)]
+
+        # Factual lookups about one facility
+        answer = self.facility_answers.answer(user_message, entities)
+        if answer:
+            return answer
+
+        # Issue reporting
+        if intent == 'report_issue' or any(word in message_lower for word in FALLBACK_KEYWORDS['issue']):
+            return "🔧 To report a facility issue:\n1. Go to the **Report Issue** page\n2. Describe the problem in detail\n3. Select the issue type and location\n4. Submit your report\n\nYou can track the status of your report from your dashboard."
+
+        # A facility named in the message
+        facility = self.facility_answers.resolve(user_message, entities)
+        if facility:
+            return self.facility_answers.describe(facility)
+
+        # Booking questions ("I want to book ...") before the library's "book" keyword
+        if intent == 'book' or 'booking' in question_kinds(user_message):
+            return self._booking_fallback(facilities)
+
+        # Facility types (computer labs, library, gym, hostels, dining): whatever matches on record
+        for topic in FALLBACK_TOPICS:
+            if any(word in message_lower for word in FALLBACK_KEYWORDS[topic]):
+                matches = self.facility_index.search(" ".join(FALLBACK_KEYWORDS[topic]), k=6)
+                if len(matches) == 1:
+                    return self.facility_answers.describe(matches[0])
+                if matches:
+                    return self.facility_answers.describe_list(matches, "📍 **Facilities matching your question:**")
+
         # Location/where queries
-        if any(word in message_lower for word in ['where', 'location', 'find']):
+        if any(word in message_lower for word in FALLBACK_KEYWORDS['location']):
             facilities_list = "📍 **UTM Campus Facilities:**\n\n"
-            # Ensure facilities_cache is available for fallback
-            if self.facilities_cache:
-                for facility in self.facilities_cache[:6]:
+            if facilities:
+                for facility in facilities[:6]:
                     facilities_list += f"• **{facility['name']}** - {facility['location']}\n"
             else:
                 facilities_list += "Unable to load facility details at the moment.\n"
             facilities_list += "\nWhat specific facility are you looking for?"
             return facilities_list
-        
-        # Issue reporting
-        if any(word in message_lower for word in ['problem', 'issue', 'broken', 'report', 'complaint']):
-            return "🔧 To report a facility issue:\n1. Go to the **Report Issue** page\n2. Describe the problem in detail\n3. Select the issue type and location\n4. Submit your report\n\nYou can track the status of your report from your dashboard."
-        
+
         # Booking queries
-        if any(word in message_lower for word in ['book', 'reserve', 'booking']):
-            return "📅 **Facility Booking:**\n• Computer Lab 1 - Available for booking\n• Gymnasium - Available for booking\n\nTo book a facility, please contact the facility management or use the booking system if available."
-        
+        if any(word in message_lower for word in FALLBACK_KEYWORDS['booking']):
+            return self._booking_fallback(facilities)
+
         # General help
         return "👋 **UTM Campus Assistant** can help you with:\n\n• 🔍 **Find facilities** - Ask about locations and details\n• 🔧 **Report issues** - Submit facility problems\n• 📅 **Booking info** - Get booking information\n• ℹ️ **General info** - Campus facility questions\n\nWhat can I help you with today?"
     
-    def classify_issue_from_description(self, description: str) -> dict:
-        """Classify issue type and priority from description"""
+    def _booking_fallback(self, facilities: list) -> str:
+        """The bookable facilities on record"""
+        bookable = [f for f in facilities if f['is_bookable']]
+        if not bookable:
+            return "📅 No facilities are available for booking at the moment."
+        return self.facility_answers.describe_list(bookable, "📅 **Facilities available for booking:**") + \
+            "\n\nUse the **Book Facility** page to reserve a time slot."
+
+    @timed_stage("classify")
+    def classify_issue_from_description(self, description: str, raise_errors: bool = False) -> dict:
+        """
+        Classify issue type and priority from description.
+        With raise_errors=True, failures propagate instead of returning the default
+        classification (used by the background job so it can retry).
+        """
+        model_raw_content = ""
         try:
             prompt = f"""
             Analyze this campus facility issue description and classify it according to the provided categories and priority levels.
@@ -351,32 +1315,16 @@ class AIService:
             }}
             """
             
-            headers = {"Authorization": f"Bearer {self.deepseek_key}"} if self.deepseek_key else {}
-
-            payload = {
-                "model": self.deepseek_model,
-                "messages": [
+            model_raw_content = self._call_llm(
+                [
                     {"role": "system", "content": "You are an expert in campus facility management and issue classification. Always respond ONLY with valid JSON, strictly adhering to the specified schema. Do not include any conversational text or markdown code blocks (e.g., ```json)."},
                     {"role": "user", "content": prompt}
                 ],
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": 300
-                },
-                "stream": False # Ensure full JSON response at once
-            }
-            response = requests.post(self.deepseek_url, json=payload, headers=headers, timeout=self.timeout) # Increased timeout
-            response.raise_for_status()
-            
-            result_data = response.json()
-            # Correctly access content from Ollama's /api/chat response
-            # model_raw_content = result_data.get("message", {}).get("content", "")
-
-            # For OpenRouter.ai: extract content from choices[0]['message']['content']
-            choices = result_data.get("choices", [])
-            model_raw_content = ""
-            if choices and "message" in choices[0]:
-                model_raw_content = choices[0]["message"].get("content", "")
+                temperature=0.3,
+                max_tokens=300,
+                task="classify",
+                json_mode=True
+            )
 
             if not model_raw_content:
                 raise ValueError("Model returned empty content for issue classification.")
@@ -384,6 +1332,7 @@ class AIService:
             result = self._extract_json_from_llm_response(model_raw_content)
 
             # Validate and normalize the parsed result
+            metrics.count_outcome("classify", "success")
             return {
                 'issue_type': result.get('issue_type', 'other').lower(),
                 'priority': result.get('priority', 'medium').lower(),
@@ -391,25 +1340,69 @@ class AIService:
             }
             
         except requests.exceptions.Timeout:
+            metrics.count_outcome("classify", "timeout")
+            if raise_errors:
+                raise
             print(f"Error classifying issue: Request timed out.")
             return {'issue_type': 'other', 'priority': 'medium', 'reasoning': 'Auto-classified: API request timed out.'}
         except requests.exceptions.RequestException as e:
+            metrics.count_outcome("classify", "api_error")
+            if raise_errors:
+                raise
             print(f"Error communicating with Ollama API for issue classification: {e}")
             print("Ensure 'ollama serve' is running and the model is available.")
             return {'issue_type': 'other', 'priority': 'medium', 'reasoning': f'Auto-classified: API communication error ({e})'}
         except json.JSONDecodeError as e:
+            metrics.count_outcome("classify", "json_error")
+            if raise_errors:
+                raise
             print(f"Error parsing JSON from model response for issue classification: {e}")
             print(f"Raw model content was: '{model_raw_content}'") # Important for debugging
             return {'issue_type': 'other', 'priority': 'medium', 'reasoning': f'Auto-classified: Invalid JSON response from model ({e})'}
         except ValueError as e: # For "Model returned empty content"
+            metrics.count_outcome("classify", "model_output_error")
+            if raise_errors:
+                raise
             print(f"Issue classification error: {e}")
             return {'issue_type': 'other', 'priority': 'medium', 'reasoning': f'Auto-classified: Model output issue ({e})'}
         except Exception as e:
+            metrics.count_outcome("classify", "unexpected_error")
+            if raise_errors:
+                raise
             print(f"An unexpected error occurred during issue classification: {e}")
             return {'issue_type': 'other', 'priority': 'medium', 'reasoning': f'Auto-classified: Unexpected internal error ({e})'}
 
-# Global AI service instance
-# This line should ideally be placed in your main app file (e.g., app.py)
-# after 'app' and 'db' are defined, or handled via Flask's application factory pattern.
-# For now, it remains here, but be mindful of import order in your full application.
-ai_service = AIService()
\ No newline at end of file
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_ai_service() -> AIService:
+    """Return the process-wide AIService, building it on first use"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = AIService()
+    return _instance
+
+def reset_ai_service():
+    """Drop the instance so the next use builds a new one (e.g. in a freshly forked worker)"""
+    global _instance
+    with _instance_lock:
+        _instance = None
+
+def _facility_changed(mapper, connection, target):
+    """
+    Bump the facilities version in the same transaction as the change, so every
+    worker reloads its cache; this worker also drops its cached replies at once.
+    """
+    bump_version(connection, FACILITIES)
+    if _instance is not None:
+        _instance.invalidate_facility_data()
+
+for _facility_event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Facility, _facility_event, _facility_changed)
+
+# Global AI service. The proxy defers building AIService (config, model file,
+# connection pool) until the first attribute access, so importing this module
+# is cheap and a gunicorn --preload parent never opens provider connections.
+ai_service = LocalProxy(get_ai_service)
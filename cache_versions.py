@@ -0,0 +1,21 @@
+from datetime import datetime
+from sqlalchemy import select
+from db_config import increment
+from models import CacheVersion
+
+# Cross-process cache invalidation. Each cached dataset has a row in
+# cache_versions whose counter is bumped in the same transaction that changes
+# the data. Workers remember the version they loaded and compare it with the
+# stored one from time to time, reloading only when it has moved on.
+
+FACILITIES = 'facilities'
+
+_table = CacheVersion.__table__
+
+def bump_version(connection, name):
+    """Increment a version on the given connection, inside the caller's transaction"""
+    increment(connection, _table, {"name": name}, "version", 1, updated_at=datetime.utcnow())
+
+def read_version(connection, name):
+    """Current version of a dataset (0 if it has never changed)"""
+    return connection.execute(select(_table.c.version).where(_table.c.name == name)).scalar() or 0
@@ -0,0 +1,151 @@
+import random
+import time
+import click
+from sqlalchemy.exc import OperationalError
+from flask_app import app, db, init_database
+from models import ChatMessage, Facility
+from ai_service import ai_service, FALLBACK_KEYWORDS, FALLBACK_KEYWORD_INTENTS
+from intent_classifier import IntentClassifier, seed_examples
+from job_queue import start_workers, queue_depth
+
+# Flask CLI commands, run with e.g. `flask --app main train-intent`
+
+# Intent labels worth learning from: the LLM's, and corrections an admin made
+# by setting intent_source to 'admin'. Labels the fast path or a template
+# produced would only teach the classifier its own guesses back.
+TRAINABLE_INTENT_SOURCES = ('llm', 'admin')
+
+@app.cli.command('init-db')
+@click.option('--seed', is_flag=True, help='Also add the sample facilities.')
+def init_db(seed):
+    """Create missing tables and apply schema upgrades."""
+    started = time.perf_counter()
+    init_database(seed=seed)
+    click.echo(f"Database ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+@app.cli.command('seed')
+def seed():
+    """Add the sample facilities if there are none yet."""
+    from routes import create_sample_data
+    create_sample_data()
+
+@app.cli.command('train-intent')
+@click.option('--output', default=None, help='Where to write the model (default: INTENT_MODEL_PATH).')
+@click.option('--threshold', type=float, default=None, help='Confidence needed to skip the LLM (default: INTENT_FAST_PATH_THRESHOLD).')
+@click.option('--holdout', type=float, default=0.2, show_default=True, help='Fraction of stored chat labels held out for the report.')
+def train_intent(output, threshold, holdout):
+    """Retrain the local intent classifier from stored chat messages."""
+    output = output or ai_service.intent_model_path
+    threshold = threshold if threshold is not None else ai_service.intent_fast_path_threshold
+
+    labelled = [
+        (m.message, m.intent)
+        for m in db.session.query(ChatMessage.message, ChatMessage.intent)
+                           .filter(ChatMessage.is_user == True, ChatMessage.intent.isnot(None),
+                                   ChatMessage.intent_source.in_(TRAINABLE_INTENT_SOURCES))
+    ]
+    facility_names = [name for (name,) in db.session.query(Facility.name).filter(Facility.is_active == True)]
+    seeds = seed_examples(FALLBACK_KEYWORDS, FALLBACK_KEYWORD_INTENTS, facility_names)
+    click.echo(f"Training data: {len(labelled)} labelled chat messages, {len(seeds)} seed phrases")
+
+    # Report on held-out chat messages: how often the fast path would answer, and how accurately
+    random.Random(42).shuffle(labelled)
+    split = int(len(labelled) * holdout)
+    test_set, train_set = labelled[:split], labelled[split:]
+    if test_set:
+        model = IntentClassifier.train(seeds + train_set)
+        confident = correct = 0
+        for text, expected in test_set:
+            intent, confidence = model.predict(text)
+            if confidence >= threshold:
+                confident += 1
+                correct += intent == expected
+        click.echo(f"Held-out messages: {len(test_set)}")
+        click.echo(f"  LLM calls saved at threshold {threshold}: {confident / len(test_set):.1%}")
+        if confident:
+            click.echo(f"  Fast-path accuracy vs stored labels: {correct / confident:.1%}")
+    else:
+        click.echo("Not enough stored chat messages for a held-out report.")
+
+    model = IntentClassifier.train(seeds + labelled)
+    model.save(output)
+    click.echo(f"Saved intent model ({model.vocabulary_size} tokens) to {output}")
+    click.echo("Restart the app workers to load the new model.")
+
+@app.cli.command('run-worker')
+@click.option('--concurrency', type=int, default=2, show_default=True, help='Number of worker threads.')
+def run_worker(concurrency):
+    """Process background jobs in a separate process (JOB_QUEUE_MODE=external)."""
+    workers = start_workers(app, concurrency)
+    try:
+        while True:
+            time.sleep(60)
+            click.echo(f"Queue depth: {queue_depth()}")
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', '-v', is_flag=True, help='Print every query plan, not only the failing ones.')
+def check_query_plans(verbose):
+    """Fail if a hot query would read a whole table, or a page would sort (SQLite only)."""
+    from query_plans import explain, full_scans, hot_queries, paged_queries, sorts
+    if db.engine.dialect.name != "sqlite":
+        raise click.ClickException("EXPLAIN QUERY PLAN checks need a SQLite database")
+    tables = set(db.metadata.tables)
+    checks = [(name, statement, False) for name, statement in hot_queries()]
+    checks += [(name, statement, True) for name, statement in paged_queries()]
+    failed = []
+    with db.engine.connect() as conn:
+        for name, statement, paged in checks:
+            try:
+                plan = explain(conn, statement)
+            except OperationalError as e:
+                failed.append(name)
+                click.echo(f"{'ERROR':9}  {name}: {e.orig}")
+                continue
+            problem = "FULL SCAN" if full_scans(plan, tables) else "SORT" if paged and sorts(plan) else None
+            if problem:
+                failed.append(name)
+            if problem or verbose:
+                click.echo(f"{problem or 'ok':9}  {name}")
+                for line in plan:
+                    click.echo(f"           {line}")
+    if failed:
+        click.echo(f"{len(failed)} queries scan a whole table, sort a whole page or do not match the schema. "
+                   "Run `flask --app main init-db` to upgrade the schema.")
+        raise SystemExit(1)
+    click.echo("All hot queries use an index.")
+
+@app.cli.command('check-query-counts')
+@click.option('--rows', type=int, default=2, show_default=True, help='Rows per page in the first pass (N); the second adds as many again.')
+def check_query_counts(rows):
+    """Fail if a list page runs more SQL statements with 2N rows than with N (an N+1 query)."""
+    from query_counts import compare_statement_counts
+    before, after = compare_statement_counts(rows)
+    grew = [endpoint for endpoint in before if after[endpoint] > before[endpoint]]
+    for endpoint in before:
+        status = "GROWS" if endpoint in grew else "ok"
+        click.echo(f"{status:5}  {endpoint}: {before[endpoint]} statements with {rows} rows, "
+                   f"{after[endpoint]} with {rows * 2}")
+    if grew:
+        click.echo(f"{len(grew)} pages run a query per row; eager-load the relations they show "
+                   "(see BOOKING_LIST_OPTIONS and ISSUE_LIST_OPTIONS in routes.py).")
+        raise SystemExit(1)
+    click.echo("No list page runs more statements for more rows.")
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts():
+    """Rebuild the dashboard status counters from the issues and bookings tables."""
+    from sqlalchemy import select
+    from models import StatusCount
+    from status_counts import rebuild_counts
+    with db.engine.begin() as conn:
+        table = StatusCount.__table__
+        before = {(name, user_id, status): count for name, user_id, status, count in conn.execute(select(table))}
+        after = rebuild_counts(conn)
+    drifted = {key for key in set(before) | set(after) if before.get(key, 0) != after.get(key, 0)}
+    for name, user_id, status in sorted(drifted):
+        who = "all users" if user_id == 0 else f"user {user_id}"
+        click.echo(f"  {name} {status} ({who}): {before.get((name, user_id, status), 0)} -> {after.get((name, user_id, status), 0)}")
+    click.echo(f"Rebuilt {len(after)} counters, {len(drifted)} had drifted.")
@@ -0,0 +1,147 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event, insert, text, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+# Database URL, engine options and the SQLite production profile.
+#
+# SQLite is tuned per connection through a SQLAlchemy "connect" event: WAL
+# lets readers run alongside the single writer, busy_timeout makes a writer
+# wait for the lock instead of failing with "database is locked", and
+# synchronous=NORMAL is safe under WAL (a power cut can lose the last
+# commits, never corrupt the file). SQLITE_PROFILE=legacy keeps SQLite's
+# defaults (rollback journal), for comparison.
+
+DEFAULT_SQLITE_URL = "sqlite:///utm_campus.db"
+
+
+def database_url() -> str:
+    """DATABASE_URL (SQLite, PostgreSQL, MySQL...), or the bundled SQLite file"""
+    url = os.environ.get("DATABASE_URL") or DEFAULT_SQLITE_URL
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]  # Heroku/Replit style URLs
+    return url
+
+
+def sqlite_pragmas() -> dict:
+    """PRAGMAs applied to every new SQLite connection, from SQLITE_PROFILE and overrides"""
+    if os.environ.get("SQLITE_PROFILE", "production").lower() == "legacy":
+        return {}
+    return {
+        "journal_mode": "WAL",
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "foreign_keys": "ON",
+        "cache_size": -int(os.environ.get("SQLITE_CACHE_SIZE_KB", "20000")),  # Negative = KiB
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024))),
+        "temp_store": "MEMORY",
+    }
+
+
+def engine_options(url: str) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    if not url.startswith("sqlite"):
+        # Server databases drop idle connections; recycle and ping before use
+        return {
+            "pool_recycle": 300,
+            "pool_pre_ping": True,
+            "pool_size": int(os.environ.get("DB_POOL_SIZE") or 5),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 10),
+        }
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        return {}  # In-memory databases live on a single connection
+    # A SQLite connection is a file handle: nothing to recycle or ping. Keep one per
+    # request thread and job worker, and let busy_timeout do the waiting for the write lock.
+    threads = int(os.environ.get("GUNICORN_THREADS", "1") or 1)
+    workers = int(os.environ.get("JOB_WORKERS", "1") or 1)
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE") or threads + workers + 1),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW") or 5),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT") or 10),
+        "connect_args": {"check_same_thread": False},
+    }
+
+
+@event.listens_for(Engine, "connect")
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    pragmas = sqlite_pragmas()
+    if not pragmas:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        # busy_timeout first, so switching to WAL waits for other connections too
+        cursor.execute(f"PRAGMA busy_timeout = {pragmas['busy_timeout']}")
+        for name, value in pragmas.items():
+            if name != "busy_timeout":
+                cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_statements = g.get("sql_statements", 0) + 1
+
+
+def sql_statement_count() -> int:
+    """SQL statements run so far while handling the current request (0 outside a request)"""
+    return g.get("sql_statements", 0) if has_request_context() else 0
+
+
+def increment(connection, table, key: dict, column: str, delta: int, **values):
+    """
+    Add `delta` to `column` of the row with primary key `key`, creating it with
+    `delta` if it does not exist, as one atomic upsert. An UPDATE followed by an
+    INSERT when nothing matched races on server databases: two transactions can
+    both find no row and one of them fails on the primary key.
+    """
+    row = {**key, column: delta, **values}
+    changes = {column: table.c[column] + delta, **values}
+    dialect = connection.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        statement = (sqlite if dialect == "sqlite" else postgresql).insert(table).values(**row)
+        connection.execute(statement.on_conflict_do_update(index_elements=list(key), set_=changes))
+    elif dialect in ("mysql", "mariadb"):
+        connection.execute(mysql.insert(table).values(**row).on_duplicate_key_update(**changes))
+    else:
+        # No portable upsert; fine for a single writer
+        where = [table.c[name] == value for name, value in key.items()]
+        if connection.execute(update(table).where(*where).values(**changes)).rowcount == 0:
+            connection.execute(insert(table).values(**row))
+
+
+def sqlite_maintenance(engine):
+    """Checkpoint the WAL into the database file and refresh query planner statistics"""
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as conn:
+        # PASSIVE never blocks readers or writers; it copies what it can
+        busy, wal_pages, checkpointed = conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)")).one()
+        conn.execute(text("PRAGMA optimize"))
+    return {"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}
+
+
+def start_sqlite_maintenance(app, db, interval: float):
+    """Run sqlite_maintenance every `interval` seconds in a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    result = sqlite_maintenance(db.engine)
+                logging.debug(f"SQLite maintenance: {result}")
+            except Exception as e:
+                logging.warning(f"SQLite maintenance failed: {e}")
+
+    thread = threading.Thread(target=loop, name="sqlite-maintenance", daemon=True)
+    thread.start()
+    return thread
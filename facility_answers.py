@@ -0,0 +1,130 @@
+import re
+
+from facility_index import tokenize
+
+# Deterministic answers to factual facility questions ("where is X", "when
+# does X open", "can I book X", "how many people fit in X"), rendered from the
+# facility cache. The chat routes answer these without any LLM call, and the
+# rule-based fallback uses the same templates, so both always match the data.
+
+# Question kinds, in the order their answers are given
+QUESTION_PATTERNS = [
+    ("location", re.compile(r"\b(where|location|located|find|directions?|how (do i|to) get)\b")),
+    ("hours", re.compile(r"\b(what time|when|hours?|opens?|opening|closes?|closing)\b")),
+    ("booking", re.compile(r"\b(book (it|the|a|an|this)|to book|i book|booking|bookable|reserve|reservation)\b")),
+    ("capacity", re.compile(r"\b(capacity|how many (people|students|persons|seats|workstations|computers)|how big|seats?)\b")),
+    ("contact", re.compile(r"\b(contact|phone|email|call)\b")),
+]
+
+# Questions that need judgement or explanation go to the LLM even if they mention a lookup
+OPEN_ENDED_PATTERN = re.compile(r"\b(why|recommend|best|better|compare|difference|should i|tell me about|explain)\b")
+
+# Longer messages are usually more than a lookup
+MAX_LOOKUP_WORDS = 15
+
+TEMPLATES = {
+    "location": "📍 **{name}** is located at **{location}**.",
+    "hours": "🕒 **{name}** is open **{operating_hours}**.",
+    "hours_unknown": "🕒 I don't have opening hours on record for **{name}**.",
+    "booking": "📅 **{name}** is available for booking. Use the **Book Facility** page to reserve a time slot.",
+    "not_bookable": "📅 **{name}** is not available for booking.",
+    "capacity": "👥 **{name}** has a capacity of **{capacity}**.",
+    "capacity_unknown": "👥 I don't have capacity information on record for **{name}**.",
+    "contact": "📞 You can contact **{name}** at {contact_info}.",
+    "contact_unknown": "📞 I don't have contact details on record for **{name}**.",
+    "inactive": "⚠️ **{name}** is currently unavailable.",
+}
+
+
+def question_kinds(message: str) -> list:
+    """Lookup kinds asked for in a message, or [] if it is not a plain lookup"""
+    lowered = (message or "").lower()
+    if OPEN_ENDED_PATTERN.search(lowered) or len(lowered.split()) > MAX_LOOKUP_WORDS:
+        return []
+    return [kind for kind, pattern in QUESTION_PATTERNS if pattern.search(lowered)]
+
+
+class FacilityAnswers:
+    """Resolves the facility a message is about and renders answers from its cached row"""
+
+    def __init__(self, facilities: list):
+        self.facilities = facilities
+        self.by_name = {f['name'].lower(): f for f in facilities}
+
+    def resolve(self, message: str, entities: dict = None):
+        """
+        The one facility the message (or its extracted facility entity) names,
+        or None when none or several match.
+        """
+        candidates = []
+        entity = ((entities or {}).get('facility') or "").strip().lower()
+        if entity and entity not in ("null", "none"):
+            if entity in self.by_name:
+                return self.by_name[entity]
+            candidates.append((entity, True))
+        candidates.append(((message or "").lower(), False))
+
+        for text, is_entity in candidates:
+            # Full names first, longest first so "Computer Lab 1" wins over "Lab"
+            named = [f for name, f in sorted(self.by_name.items(), key=lambda item: -len(item[0]))
+                     if re.search(rf"\b{re.escape(name)}\b", text)]
+            if named:
+                return named[0]
+            # Then short forms: "gym" for "Gymnasium", if exactly one facility fits. The
+            # extracted entity names a facility, so one word of it is enough; in the raw
+            # message every word of the name must be there, or "female toilet" would be
+            # Female Hostel Block D.
+            words = tokenize(text)
+            matches = {f['name']: f for f in self.facilities
+                       if (any if is_entity else all)(self._covered(t, words) for t in tokenize(f['name']))}
+            if len(matches) == 1:
+                return next(iter(matches.values()))
+        return None
+
+    @staticmethod
+    def _covered(name_token: str, words: list) -> bool:
+        """Whether a word of the message is the name token or, from 3 letters, a prefix of it"""
+        return any(w == name_token or (len(w) >= 3 and name_token.startswith(w)) for w in words)
+
+    def answer(self, message: str, entities: dict = None):
+        """Rendered answer to a factual lookup, or None if the message needs the LLM"""
+        kinds = question_kinds(message)
+        if not kinds:
+            return None
+        facility = self.resolve(message, entities)
+        if facility is None:
+            return None
+        return self.render(facility, kinds)
+
+    def render(self, facility: dict, kinds: list) -> str:
+        lines = [] if facility.get('is_active', True) else [TEMPLATES["inactive"].format(**facility)]
+        for kind in kinds:
+            if kind == "location":
+                lines.append(TEMPLATES["location"].format(**facility))
+            elif kind == "hours":
+                lines.append(TEMPLATES["hours" if facility.get('operating_hours') else "hours_unknown"].format(**facility))
+            elif kind == "booking":
+                lines.append(TEMPLATES["booking" if facility.get('is_bookable') else "not_bookable"].format(**facility))
+            elif kind == "capacity":
+                lines.append(TEMPLATES["capacity" if facility.get('capacity') else "capacity_unknown"].format(**facility))
+            elif kind == "contact":
+                lines.append(TEMPLATES["contact" if facility.get('contact_info') else "contact_unknown"].format(**facility))
+        return "\n".join(lines)
+
+    def describe(self, facility: dict) -> str:
+        """Everything on record about one facility"""
+        kinds = ["location"]
+        if facility.get('operating_hours'):
+            kinds.append("hours")
+        if facility.get('capacity'):
+            kinds.append("capacity")
+        kinds.append("booking")
+        text = self.render(facility, kinds)
+        if facility.get('description'):
+            text += f"\n{facility['description']}."
+        return text
+
+    @staticmethod
+    def describe_list(facilities: list, heading: str) -> str:
+        lines = [heading, ""] + [f"• **{f['name']}** - {f['location']}" for f in facilities]
+        return "\n".join(lines)
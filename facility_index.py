@@ -0,0 +1,71 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "of", "in", "on", "at", "to", "for", "and", "or",
+    "i", "me", "my", "you", "can", "do", "does", "how", "what", "where", "when", "which",
+    "it", "this", "that", "there", "with", "please", "want", "need", "about", "tell",
+}
+
+# Field weights: a hit in the facility name counts more than one in the description
+FIELD_WEIGHTS = {"name": 3, "category": 2, "location": 2, "description": 1}
+
+
+def tokenize(text: str) -> list:
+    return [t for t in TOKEN_PATTERN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+class FacilityIndex:
+    """
+    In-memory BM25 index over the facility cache, used to pick the few
+    facilities relevant to a message for the LLM prompt. Fields are weighted
+    by repeating their terms (a simple BM25F approximation). Scoring walks an
+    inverted index, so only facilities sharing a term with the query are scored.
+    """
+
+    def __init__(self, facilities: list, k1: float = 1.2, b: float = 0.75):
+        self.facilities = facilities
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(doc index, term frequency)]
+        self.doc_lengths = []
+
+        for doc_id, facility in enumerate(facilities):
+            terms = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokenize(facility.get(field)):
+                    terms[token] += weight
+            self.doc_lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings[term].append((doc_id, frequency))
+
+        self.average_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0
+        total = len(facilities)
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> list:
+        """Return up to k facilities ranked by BM25 score (best first)."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.average_length or 1)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:k]
+        return [self.facilities[doc_id] for doc_id in ranked]
+
+    def top_k(self, query: str, k: int) -> list:
+        """
+        Like search, but when nothing matches (e.g. "what can you do?") fall
+        back to the first k facilities so the prompt still has some context.
+        """
+        return self.search(query, k) or self.facilities[:k]
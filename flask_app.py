@@ -1,4 +1,5 @@
 import os
+import time
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -7,10 +8,12 @@ from flask_bcrypt import Bcrypt
 from flask_wtf.csrf import CSRFProtect
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from db_config import database_url, engine_options, start_sqlite_maintenance
 # Environment variables are handled by Replit automatically
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
+_imported_at = time.perf_counter()
 
 class Base(DeclarativeBase):
     pass
@@ -26,17 +29,10 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "replit-utm-campus-assistant-fallback-key")
 #app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Configure the database - SQLite for simplicity and portability
-database_url = os.environ.get("DATABASE_URL")
-if database_url and database_url.startswith("sqlite"):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-else:
-    # Default to SQLite if no valid DATABASE_URL provided
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///utm_campus.db"
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# Configure the database - SQLite by default (tuned for concurrent workers, see db_config.py),
+# or any database SQLAlchemy supports via DATABASE_URL
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Initialize extensions with app
@@ -56,16 +52,68 @@ def load_user(user_id):
     from models import User
     return User.query.get(int(user_id))
 
-with app.app_context():
-    # Import models to ensure tables are created
+def init_database(seed=False):
+    """Create missing tables, apply column/index upgrades and optionally add sample data"""
+    # Import models so their tables are registered on the metadata
     import models
+    from schema_migrations import upgrade_schema
+    from status_counts import ensure_counts
     db.create_all()
+    upgrade_schema(db)
+    ensure_counts(db.engine)
     logging.info("Database tables created")
-    
-    # Initialize sample data
-    from routes import create_sample_data
-    create_sample_data()
+    if seed:
+        from routes import create_sample_data
+        create_sample_data()
 
-from routes import docs_bp
+def start_background_services(app):
+    """
+    Per-process background threads: job workers and the response cache warmup.
+    Started only by the web server: gunicorn's worker hook (threads do not
+    survive fork, so each worker starts its own) or `python main.py`. Flask CLI
+    commands such as run-worker or init-db never start them.
+    """
+    # Background job workers run inside the web process unless JOB_QUEUE_MODE=external,
+    # in which case `flask --app main run-worker` processes the queue separately
+    if os.environ.get("JOB_QUEUE_MODE", "inprocess") == "inprocess":
+        from job_queue import start_workers
+        start_workers(app, int(os.environ.get("JOB_WORKERS", "1")))
 
-app.register_blueprint(docs_bp)
+    # Periodic WAL checkpoint and PRAGMA optimize for SQLite
+    maintenance_interval = float(os.environ.get("SQLITE_MAINTENANCE_INTERVAL", "300"))
+    if maintenance_interval > 0 and app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        start_sqlite_maintenance(app, db, maintenance_interval)
+
+    # Optionally pre-answer the most frequent questions in the background
+    warmup = int(os.environ.get("RESPONSE_CACHE_WARMUP", "0"))
+    if warmup:
+        from ai_service import ai_service
+        ai_service.start_cache_warmup(warmup)
+
+_app_ready = False
+
+def create_app():
+    """
+    Finish setting up the application: register routes and CLI commands and,
+    unless AUTO_INIT_DB=0, create missing tables. Sample data is only added by
+    `flask --app main init-db --seed`. Nothing here opens LLM connections or
+    starts background threads; see start_background_services. Safe to call
+    more than once.
+    """
+    global _app_ready
+    if _app_ready:
+        return app
+    started = time.perf_counter()
+
+    import routes
+    import commands
+    app.register_blueprint(routes.docs_bp)
+
+    if os.environ.get("AUTO_INIT_DB", "1") != "0":
+        with app.app_context():
+            init_database()
+
+    _app_ready = True
+    logging.info("Application ready in %.0f ms (%.0f ms since flask_app was imported)",
+                 (time.perf_counter() - started) * 1000, (time.perf_counter() - _imported_at) * 1000)
+    return app
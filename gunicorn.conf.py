@@ -0,0 +1,32 @@
+import os
+import sys
+import time
+
+# Production settings, picked up automatically by `gunicorn main:app`.
+#
+# With preload the parent imports the app once (Flask, SQLAlchemy, routes) and
+# workers fork from it, so each worker starts warm. Anything that must not be
+# shared across processes - pooled DB connections, the LLM connection pool,
+# background threads - is reset or started in the worker hooks below.
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+# --reload needs each worker to import the code itself
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0" and "--reload" not in sys.argv
+
+
+def post_fork(server, worker):
+    worker.boot_started = time.perf_counter()
+
+
+def post_worker_init(worker):
+    from flask_app import app, db, start_background_services
+    from ai_service import reset_ai_service
+
+    # Drop DB connections inherited from the parent without closing them under its feet
+    with app.app_context():
+        db.engine.dispose(close=False)
+    reset_ai_service()
+    start_background_services(app)
+    worker.log.info("Worker %s booted in %.0f ms", worker.pid, (time.perf_counter() - worker.boot_started) * 1000)
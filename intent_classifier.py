@@ -0,0 +1,195 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+INTENTS = ["search", "explore", "book", "report_issue", "check_status", "general_info"]
+
+# Keywords used to fill the issue_type entity without asking the LLM
+ISSUE_TYPE_KEYWORDS = {
+    "electrical": ["light", "lights", "lamp", "power", "socket", "plug", "wiring", "electric", "electricity", "aircon", "air conditioner", "air conditioning", "ac", "fan"],
+    "hygiene": ["dirty", "smell", "smelly", "toilet", "rubbish", "trash", "rat", "rats", "cockroach", "pest", "clean", "flush"],
+    "structural": ["leak", "leaking", "crack", "ceiling", "wall", "roof", "floor", "pipe", "window"],
+    "equipment": ["projector", "computer", "pc", "chair", "table", "desk", "printer", "mic", "microphone", "speaker", "whiteboard", "weights"],
+    "security": ["lock", "door", "stolen", "theft", "alarm", "cctv", "intruder", "unsafe"],
+}
+
+LOCATION_PATTERN = re.compile(r"\b(block\s+[a-z0-9]+|level\s+\d+|n28a?|ground floor)\b", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    """Lower-cased word unigrams plus adjacent bigrams."""
+    words = TOKEN_PATTERN.findall((text or "").lower())
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class IntentClassifier:
+    """
+    Multinomial Naive Bayes intent classifier small enough to run in-process.
+    Trained offline (``flask train-intent``) and stored as JSON, so loading it
+    needs no extra dependencies and predicting takes microseconds.
+    """
+
+    def __init__(self, class_counts=None, token_counts=None, vocabulary_size=0):
+        self.class_counts = class_counts or {}
+        self.token_counts = token_counts or {}
+        self.vocabulary_size = vocabulary_size
+        self._prepare()
+
+    def _prepare(self):
+        total = sum(self.class_counts.values()) or 1
+        self.log_priors = {c: math.log(n / total) for c, n in self.class_counts.items()}
+        self.token_totals = {c: sum(tokens.values()) for c, tokens in self.token_counts.items()}
+        self.vocabulary = set()
+        for tokens in self.token_counts.values():
+            self.vocabulary.update(tokens)
+
+    @classmethod
+    def train(cls, examples) -> "IntentClassifier":
+        """Train from an iterable of (text, intent) pairs."""
+        class_counts = Counter()
+        token_counts = defaultdict(Counter)
+        for text, intent in examples:
+            if intent not in INTENTS:
+                continue
+            tokens = tokenize(text)
+            if not tokens:
+                continue
+            class_counts[intent] += 1
+            token_counts[intent].update(tokens)
+        vocabulary = set()
+        for tokens in token_counts.values():
+            vocabulary.update(tokens)
+        return cls(dict(class_counts), {c: dict(t) for c, t in token_counts.items()}, len(vocabulary))
+
+    @property
+    def is_trained(self) -> bool:
+        return bool(self.class_counts)
+
+    def predict(self, text: str) -> tuple:
+        """
+        Return (intent, confidence). Confidence is the posterior probability
+        scaled by the share of words the model has seen, so messages that are
+        mostly out of vocabulary are never confident enough to skip the LLM.
+        """
+        all_tokens = tokenize(text)
+        tokens = [t for t in all_tokens if t in self.vocabulary]
+        if not tokens or not self.is_trained:
+            return "general_info", 0.0
+        words = [t for t in all_tokens if "_" not in t]
+        coverage = sum(1 for t in words if t in self.vocabulary) / len(words)
+
+        scores = {}
+        for intent, log_prior in self.log_priors.items():
+            counts = self.token_counts.get(intent, {})
+            denominator = self.token_totals.get(intent, 0) + self.vocabulary_size
+            score = log_prior
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / denominator)
+            scores[intent] = score
+
+        best = max(scores, key=scores.get)
+        # Softmax over log scores, shifted for numerical stability
+        top = scores[best]
+        normaliser = sum(math.exp(score - top) for score in scores.values())
+        return best, coverage / normaliser
+
+    def to_dict(self) -> dict:
+        return {
+            "class_counts": self.class_counts,
+            "token_counts": self.token_counts,
+            "vocabulary_size": self.vocabulary_size,
+        }
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a saved model, or return None if no model file exists."""
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("class_counts"), data.get("token_counts"), data.get("vocabulary_size", 0))
+
+
+def extract_entities(text: str, facility_names) -> dict:
+    """Rule-based entity extraction matching the schema the LLM returns."""
+    lowered = (text or "").lower()
+    words = set(TOKEN_PATTERN.findall(lowered))
+
+    facility = None
+    # Prefer the longest facility name so "Computer Lab 1" wins over "Lab"
+    for name in sorted(facility_names or [], key=len, reverse=True):
+        if name and name.lower() in lowered:
+            facility = name
+            break
+
+    issue_type = None
+    component = None
+    for candidate_type, keywords in ISSUE_TYPE_KEYWORDS.items():
+        for keyword in keywords:
+            found = keyword in lowered if " " in keyword else keyword in words
+            if found:
+                issue_type, component = candidate_type, keyword
+                break
+        if issue_type:
+            break
+
+    location_match = LOCATION_PATTERN.search(text or "")
+    return {
+        "facility": facility,
+        "location": location_match.group(0) if location_match else None,
+        "issue_type": issue_type,
+        "component": component,
+    }
+
+
+def seed_examples(keyword_sets: dict, keyword_intents: dict, facility_names) -> list:
+    """
+    Build labelled training phrases from the fallback keyword sets and the
+    facility names, so a model can be trained before any chat history exists.
+    """
+    # A keyword in sets with different intents ("book": library and booking) teaches nothing
+    keyword_labels = {}
+    for topic, keywords in keyword_sets.items():
+        for keyword in keywords:
+            keyword_labels.setdefault(keyword, set()).add(keyword_intents.get(topic))
+
+    examples = []
+    for topic, keywords in keyword_sets.items():
+        intent = keyword_intents.get(topic)
+        if not intent:
+            continue
+        for keyword in keywords:
+            if len(keyword_labels[keyword]) == 1:
+                examples.append((keyword, intent))
+
+    templates = {
+        "search": ["where is the {f}", "where can i find {f}", "how do i get to {f}", "location of {f}"],
+        "explore": ["tell me about {f}", "what facilities does {f} have", "show me {f} information", "what is {f} like"],
+        "book": ["book the {f}", "can i book {f}", "reserve {f} for tomorrow", "i want to book {f}"],
+        "report_issue": ["the {f} is broken", "report a problem in {f}", "there is an issue at {f}", "{f} light not working"],
+    }
+    for name in facility_names or []:
+        for intent, phrases in templates.items():
+            for phrase in phrases:
+                examples.append((phrase.format(f=name.lower()), intent))
+
+    examples += [
+        ("what is the status of my issue", "check_status"),
+        ("has my report been resolved", "check_status"),
+        ("check my issue status", "check_status"),
+        ("any update on my complaint", "check_status"),
+        ("hello", "general_info"),
+        ("hi there", "general_info"),
+        ("thanks", "general_info"),
+        ("what can you do", "general_info"),
+        ("help", "general_info"),
+    ]
+    return examples
@@ -0,0 +1,172 @@
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_, update
+from flask_app import db
+from models import Job, JobStatus, Issue, IssueType, Priority
+
+# Persistent job queue stored in the application database.
+#
+# Workers claim a job with a conditional UPDATE, so several threads or
+# processes can poll the same table without taking the same job twice. A
+# claimed job stays invisible until its visibility timeout expires; if the
+# worker dies mid-job it becomes claimable again. Failed jobs are retried with
+# exponential backoff until max_attempts is reached.
+
+VISIBILITY_TIMEOUT = int(os.environ.get("JOB_VISIBILITY_TIMEOUT", "300"))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+
+HANDLERS = {}
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of the given kind"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+def enqueue(kind, payload=None, delay=0, max_attempts=None):
+    """Add a job to the queue and commit it"""
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        status=JobStatus.QUEUED,
+        max_attempts=max_attempts or DEFAULT_MAX_ATTEMPTS,
+        run_after=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def _claimable(now):
+    """Jobs that are due, or running with an expired visibility timeout"""
+    return or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_after <= now),
+        and_(Job.status == JobStatus.RUNNING, Job.locked_until < now)
+    )
+
+def claim_next(worker_id):
+    """Atomically claim the next runnable job, or return None if there is none"""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(_claimable(now))\
+                           .order_by(Job.run_after).limit(5).all()
+    for (job_id,) in candidates:
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, _claimable(now))
+            .values(status=JobStatus.RUNNING,
+                    locked_by=worker_id,
+                    locked_until=now + timedelta(seconds=VISIBILITY_TIMEOUT),
+                    attempts=Job.attempts + 1,
+                    updated_at=now)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: about 5s, 10s, 20s ... capped at 5 minutes"""
+    base = min(300, 5 * 2 ** (attempts - 1))
+    return base / 2 + random.uniform(0, base / 2)
+
+def run_job(job, worker_id):
+    """Run one claimed job and record its outcome"""
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind '{job.kind}'")
+        handler(**(job.payload or {}))
+        values = {'status': JobStatus.DONE, 'locked_until': None, 'last_error': None}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {e}")
+        values = {'locked_until': None, 'last_error': traceback.format_exc()[-2000:]}
+        if job.attempts >= job.max_attempts:
+            values['status'] = JobStatus.FAILED
+        else:
+            values['status'] = JobStatus.QUEUED
+            values['run_after'] = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+
+    # Only the worker still holding the lock may record the outcome
+    values['updated_at'] = datetime.utcnow()
+    db.session.execute(update(Job).where(Job.id == job.id, Job.locked_by == worker_id).values(**values))
+    db.session.commit()
+
+def work_once(worker_id):
+    """Claim and run a single job; returns False when the queue is empty"""
+    job = claim_next(worker_id)
+    if job is None:
+        return False
+    run_job(job, worker_id)
+    return True
+
+def queue_depth():
+    """Number of jobs per status, plus how many are runnable right now"""
+    counts = {status.value: 0 for status in JobStatus}
+    for status, count in db.session.query(Job.status, func.count(Job.id)).group_by(Job.status):
+        counts[status.value] = count
+    counts['runnable'] = db.session.query(func.count(Job.id)).filter(_claimable(datetime.utcnow())).scalar()
+    return counts
+
+class JobWorker(threading.Thread):
+    """Polls the queue and runs jobs inside an application context"""
+
+    def __init__(self, app, index=0):
+        super().__init__(name=f"job-worker-{index}", daemon=True)
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    found = work_once(self.worker_id)
+            except Exception as e:
+                print(f"Job worker {self.worker_id} error: {e}")
+                found = False
+            if not found:
+                self.stop_event.wait(POLL_INTERVAL)
+
+    def stop(self):
+        self.stop_event.set()
+
+def start_workers(app, count):
+    """Start in-process worker threads"""
+    workers = [JobWorker(app, index) for index in range(count)]
+    for worker in workers:
+        worker.start()
+    print(f"Started {count} in-process job worker(s).")
+    return workers
+
+# --- Job handlers ---
+
+@job_handler('classify_issue')
+def classify_issue(issue_id, issue_type=None, priority=None):
+    """
+    Reclassify a reported issue with the LLM and write the result back.
+    `issue_type` and `priority` are the values the issue was submitted with;
+    a field that has been changed since (e.g. by an admin) is left alone.
+    """
+    from ai_service import ai_service
+    issue = db.session.get(Issue, issue_id)
+    if issue is None:
+        return # Deleted before the job ran
+
+    # raise_errors lets the queue retry instead of storing a fallback classification
+    result = ai_service.classify_issue_from_description(issue.description, raise_errors=True)
+    for column, kind, submitted in ((Issue.issue_type, IssueType, issue_type), (Issue.priority, Priority, priority)):
+        if result.get(column.key) not in {member.value for member in kind}:
+            continue
+        # Checked in the UPDATE itself, as the field may have changed during the LLM call.
+        # Jobs queued without the submitted values overwrite unconditionally, as before.
+        condition = [Issue.id == issue_id] + ([column == kind(submitted)] if submitted else [])
+        db.session.execute(update(Issue).where(*condition).values({column: kind(result[column.key])}))
+    db.session.commit()
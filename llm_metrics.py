@@ -0,0 +1,241 @@
+import functools
+import inspect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+from resilience import CircuitOpenError, DeadlineExceeded, RequestCancelled
+
+# In-process metrics for LLM calls and chat pipeline stages, rendered in the
+# Prometheus text format by /metrics. Each gunicorn worker keeps its own
+# numbers, like the other /admin/ai_stats counters.
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+# Per-chat-turn record of calls and stages, saved with the bot's ChatMessage
+_turn = ContextVar("llm_turn", default=None)
+
+
+def error_outcome(error) -> str:
+    """Short, low-cardinality outcome label for a failed provider call"""
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, RequestCancelled):
+        return "cancelled"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(error, requests.exceptions.HTTPError):
+        return "http_error"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "connection_error"
+    return "error"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class TurnRecord:
+    """What the LLM side of one chat turn cost: provider calls, stage times and outcomes"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = []
+        self.stages = {}
+        self.outcomes = []
+        self.truncated = False  # A streamed reply failed after part of it was sent
+        self.chat_mode = None  # Pipeline the turn ran (two_call, combined, parallel), e.g. its CHAT_MODE=ab arm
+        self._lock = threading.Lock()
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = {
+                "total_ms": round((time.perf_counter() - self.started) * 1000),
+                "stages": dict(self.stages),
+                "outcomes": list(self.outcomes),
+                "calls": list(self.calls),
+                "prompt_tokens": sum(c["prompt_tokens"] or 0 for c in self.calls),
+                "completion_tokens": sum(c["completion_tokens"] or 0 for c in self.calls),
+            }
+            if self.truncated:
+                summary["truncated"] = True
+            if self.chat_mode:
+                summary["chat_mode"] = self.chat_mode
+            return summary
+
+
+class LLMMetrics:
+    """Thread-safe registry of the counters and histograms exported on /metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.call_duration = defaultdict(Histogram)     # (task, model, outcome)
+        self.first_byte = defaultdict(Histogram)        # (task, model)
+        self.stage_duration = defaultdict(Histogram)    # (stage,)
+        self.tokens = defaultdict(int)                  # (task, model, kind)
+        self.retries = defaultdict(int)                 # (task, model)
+        self.stage_outcomes = defaultdict(int)          # (stage, outcome)
+
+    def observe_call(self, task, model, seconds, first_byte_seconds, prompt_tokens, completion_tokens, outcome):
+        with self._lock:
+            self.call_duration[(task, model, outcome)].observe(seconds)
+            if first_byte_seconds is not None:
+                self.first_byte[(task, model)].observe(first_byte_seconds)
+            self.tokens[(task, model, "prompt")] += prompt_tokens or 0
+            self.tokens[(task, model, "completion")] += completion_tokens or 0
+        turn = _turn.get()
+        if turn is not None:
+            with turn._lock:
+                turn.calls.append({
+                    "task": task,
+                    "model": model,
+                    "ms": round(seconds * 1000),
+                    "ttfb_ms": round(first_byte_seconds * 1000) if first_byte_seconds is not None else None,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "outcome": outcome,
+                })
+
+    def count_retry(self, task, model):
+        with self._lock:
+            self.retries[(task, model)] += 1
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self.stage_duration[(stage,)].observe(seconds)
+        turn = _turn.get()
+        if turn is not None:
+            with turn._lock:
+                turn.stages[stage] = turn.stages.get(stage, 0) + round(seconds * 1000)
+
+    def count_outcome(self, stage, outcome):
+        """Count how a pipeline stage ended: success, cache_hit, fast_path, timeout, json_error, fallback..."""
+        with self._lock:
+            self.stage_outcomes[(stage, outcome)] += 1
+        turn = _turn.get()
+        if turn is not None:
+            with turn._lock:
+                turn.outcomes.append(f"{stage}:{outcome}")
+
+    def render(self, extra=None) -> str:
+        """
+        All metrics in the Prometheus text exposition format, followed by any
+        unlabelled `extra` series given as (name, type, help, value).
+        """
+        lines = []
+        with self._lock:
+            _histogram(lines, "llm_request_duration_seconds", "Wall time of LLM provider calls, retries included",
+                       ("task", "model", "outcome"), self.call_duration)
+            _histogram(lines, "llm_time_to_first_byte_seconds", "Time until the provider started answering",
+                       ("task", "model"), self.first_byte)
+            _histogram(lines, "chat_stage_duration_seconds", "Wall time of chat pipeline stages",
+                       ("stage",), self.stage_duration)
+            _counter(lines, "llm_tokens_total", "Prompt and completion tokens (provider usage, else estimated)",
+                     ("task", "model", "kind"), self.tokens)
+            _counter(lines, "llm_retries_total", "Provider call retries", ("task", "model"), self.retries)
+            _counter(lines, "chat_stage_outcomes_total", "How chat pipeline stages ended",
+                     ("stage", "outcome"), self.stage_outcomes)
+        for name, kind, help_text, value in extra or []:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _histogram(lines, name, help_text, label_names, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key, histogram in sorted(series.items()):
+        # Bucket counts are cumulative already: observe() counts a value in every bucket above it
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f"{name}_bucket{_labels(label_names, key, ('le', bound))} {count}")
+        lines.append(f"{name}_bucket{_labels(label_names, key, ('le', '+Inf'))} {histogram.total}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {histogram.total}")
+
+
+def _counter(lines, name, help_text, label_names, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for key, value in sorted(series.items()):
+        lines.append(f"{name}{_labels(label_names, key)} {value}")
+
+
+@contextmanager
+def record_turn():
+    """Collect the calls and stages of one chat turn; yields the TurnRecord"""
+    turn = TurnRecord()
+    token = _turn.set(turn)
+    try:
+        yield turn
+    finally:
+        _turn.reset(token)
+
+
+def mark_truncated():
+    """Flag the current turn's reply as cut short"""
+    turn = _turn.get()
+    if turn is not None:
+        turn.truncated = True
+
+
+def mark_chat_mode(mode):
+    """Record which chat pipeline the current turn ran"""
+    turn = _turn.get()
+    if turn is not None:
+        turn.chat_mode = mode
+
+
+def timed_stage(stage):
+    """Decorator recording a pipeline method's wall time (generators: until exhausted)"""
+    def decorate(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    yield from func(*args, **kwargs)
+                finally:
+                    metrics.observe_stage(stage, time.perf_counter() - started)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+# Process-wide registry
+metrics = LLMMetrics()
@@ -0,0 +1,149 @@
+import json
+import os
+
+# Provider adapters: the one place that knows how each LLM API spells its
+# request fields and where it puts the answer. AIService builds payloads and
+# reads responses only through these, so token caps, sampling settings and
+# JSON mode reach the provider in the form it actually honours.
+
+
+class OpenAICompatibleAdapter:
+    """OpenAI-style /chat/completions (OpenRouter, vLLM, llama.cpp server, LM Studio)"""
+
+    name = "openai"
+    local = False
+
+    def headers(self, key: str) -> dict:
+        return {"Authorization": f"Bearer {key}"} if key else {}
+
+    def build_payload(self, model: str, messages: list, temperature: float, max_tokens: int,
+                      json_mode: bool = False, stream: bool = False) -> dict:
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream,
+        }
+        if json_mode:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def parse_response(self, data: dict) -> str:
+        """Text of the first choice of a non-streaming response"""
+        choices = data.get("choices") or []
+        if choices and "message" in choices[0]:
+            return choices[0]["message"].get("content") or ""
+        return ""
+
+    def parse_usage(self, data: dict) -> tuple:
+        """(prompt tokens, completion tokens) the provider reported, None where missing"""
+        usage = data.get("usage") or {}
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+    def parse_stream_line(self, line: str) -> tuple:
+        """(content delta, finished) for one line of a streaming response"""
+        if not line or line.startswith(":"):
+            return "", False # Keep-alive comments and event separators
+        if line.startswith("data:"):
+            line = line[len("data:"):].strip()
+        if line == "[DONE]":
+            return "", True
+        try:
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            return "", False
+        choices = chunk.get("choices") or []
+        if not choices:
+            return "", False
+        delta = choices[0].get("delta") or choices[0].get("message") or {}
+        return delta.get("content") or "", choices[0].get("finish_reason") is not None
+
+
+class OllamaAdapter:
+    """Ollama /api/chat: sampling settings live under "options", JSON mode is format=json"""
+
+    name = "ollama"
+    local = False
+
+    def headers(self, key: str) -> dict:
+        return {"Authorization": f"Bearer {key}"} if key else {}
+
+    def build_payload(self, model: str, messages: list, temperature: float, max_tokens: int,
+                      json_mode: bool = False, stream: bool = False) -> dict:
+        options = {"temperature": temperature, "num_predict": max_tokens}
+        payload = {"model": model, "messages": messages, "options": options, "stream": stream}
+        if json_mode:
+            payload["format"] = "json"
+        return payload
+
+    def parse_response(self, data: dict) -> str:
+        return (data.get("message") or {}).get("content") or ""
+
+    def parse_usage(self, data: dict) -> tuple:
+        return data.get("prompt_eval_count"), data.get("eval_count")
+
+    def parse_stream_line(self, line: str) -> tuple:
+        """Ollama streams one JSON object per line (NDJSON)"""
+        if not line:
+            return "", False
+        try:
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            return "", False
+        return (chunk.get("message") or {}).get("content") or "", bool(chunk.get("done"))
+
+
+class StubAdapter:
+    """
+    Answers in-process without any network call, for offline development and
+    for measuring the app's own overhead. Replies with LLM_STUB_RESPONSE, or
+    "{}" in JSON mode (callers then use their default intent/classification).
+    """
+
+    name = "stub"
+    local = True
+
+    def __init__(self, reply: str = None):
+        self.reply = reply or os.environ.get("LLM_STUB_RESPONSE", "This is a stub reply from the local test provider.")
+
+    def headers(self, key: str) -> dict:
+        return {}
+
+    def build_payload(self, model: str, messages: list, temperature: float, max_tokens: int,
+                      json_mode: bool = False, stream: bool = False) -> dict:
+        return {"model": model, "messages": messages, "max_tokens": max_tokens, "json_mode": json_mode, "stream": stream}
+
+    def complete(self, payload: dict) -> str:
+        if payload.get("json_mode"):
+            return "{}"
+        # Respect the token cap roughly (about 4 characters per token)
+        return self.reply[:max(1, payload.get("max_tokens") or 0) * 4]
+
+    def stream(self, payload: dict):
+        words = self.complete(payload).split(" ")
+        for index, word in enumerate(words):
+            yield word if index == 0 else " " + word
+
+
+ADAPTERS = {
+    "openai": OpenAICompatibleAdapter,
+    "ollama": OllamaAdapter,
+    "stub": StubAdapter,
+}
+
+
+def infer_provider(url: str) -> str:
+    """Provider name for an endpoint URL when none is configured"""
+    if not url or url.startswith("stub:"):
+        return "stub"
+    if url.rstrip("/").endswith("/api/chat"):
+        return "ollama"
+    return "openai"
+
+
+def get_adapter(provider: str):
+    try:
+        return ADAPTERS[provider]()
+    except KeyError:
+        raise ValueError(f"Unknown LLM provider '{provider}' (expected one of: {', '.join(ADAPTERS)})")
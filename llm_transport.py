@@ -0,0 +1,122 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+
+def _default_pool_size() -> int:
+    """
+    Size the pool for one gunicorn worker: each request thread can hold up to
+    two provider calls (intent + reply), so allow two connections per thread.
+    """
+    threads = int(os.environ.get("GUNICORN_THREADS", "1") or 1)
+    return max(2, threads * 2)
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive probes on pooled sockets."""
+
+    def __init__(self, tcp_keepalive: bool = True, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            socket_options = list(HTTPConnection.default_socket_options)
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledTransport:
+    """
+    Keep-alive HTTP transport for LLM provider calls.
+
+    One urllib3 connection pool (inside a single HTTPAdapter) is shared by
+    every thread of the worker process, so TCP+TLS handshakes are paid once
+    per connection rather than once per call. Each thread gets its own
+    requests.Session mounted on that adapter, because Session objects carry
+    per-request state (cookies, hooks) that is not safe to share.
+    """
+
+    def __init__(self, pool_size: int = None, connect_timeout: float = None,
+                 read_timeout: float = None, tcp_keepalive: bool = None):
+        self.pool_size = pool_size or int(os.environ.get("LLM_POOL_SIZE", 0) or _default_pool_size())
+        self.connect_timeout = connect_timeout or float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = read_timeout or float(os.environ.get("LLM_READ_TIMEOUT", "60"))
+        if tcp_keepalive is None:
+            tcp_keepalive = os.environ.get("LLM_TCP_KEEPALIVE", "1") != "0"
+
+        self.adapter = KeepAliveAdapter(
+            tcp_keepalive=tcp_keepalive,
+            pool_connections=4,            # Distinct provider hosts kept in the pool manager
+            pool_maxsize=self.pool_size,   # Connections kept open per host
+            pool_block=False               # Overflow opens a temporary connection instead of waiting
+        )
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._latencies = deque(maxlen=500)
+
+    @property
+    def timeout(self) -> tuple:
+        """(connect, read) timeout pair passed to requests."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            session.headers["Connection"] = "keep-alive"
+            self._local.session = session
+        return session
+
+    def post(self, url: str, timeout=None, **kwargs) -> requests.Response:
+        """POST through the shared pool. Accepts the same arguments as requests.post."""
+        started = time.perf_counter()
+        try:
+            return self._session().post(url, timeout=timeout or self.timeout, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._request_count += 1
+                self._latencies.append(elapsed_ms)
+
+    def _connection_count(self) -> int:
+        """Number of TCP connections opened so far across all provider hosts."""
+        pools = self.adapter.poolmanager.pools
+        total = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total += pool.num_connections
+        return total
+
+    def stats(self) -> dict:
+        """Connection reuse and latency counters for this worker process."""
+        with self._lock:
+            requests_sent = self._request_count
+            latencies = sorted(self._latencies)
+        connections = self._connection_count()
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 1)
+
+        return {
+            "pool_size": self.pool_size,
+            "requests": requests_sent,
+            "connections_opened": connections,
+            "connections_reused": max(0, requests_sent - connections),
+            "reuse_ratio": round(1 - connections / requests_sent, 3) if requests_sent else None,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+        }
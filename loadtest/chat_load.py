@@ -0,0 +1,276 @@
+"""
+Load driver for the chat endpoint.
+
+Logs in N simulated students and replays short conversations against
+/api/chat (or /api/chat/stream with --stream) at a target total rate, then
+reports latency percentiles, throughput and error rate.
+
+Against a server that is already running:
+
+    python loadtest/chat_load.py --base-url http://127.0.0.1:5000 --users 20 --rate 5 --duration 60
+
+Or let the driver start the stub provider and one gunicorn per worker
+configuration (WORKERSxTHREADS), each on a fresh SQLite database:
+
+    python loadtest/chat_load.py --configs 1x1,2x1,2x4,4x4 --users 20 --rate 10 --duration 30
+
+Latency is measured from when a message is sent. A student waits for each
+reply before sending the next message, so an overloaded server shows up as
+an achieved rate below the target as well as in the percentiles.
+"""
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONVERSATIONS = [
+    ["Where is the library?", "What time does it open?", "Can I book a study room there?"],
+    ["I want to book the gymnasium", "Is it available tomorrow evening?", "Thanks!"],
+    ["The lights in Computer Lab 1 are not working", "It's on level 2 of Block A", "How do I check the status?"],
+    ["Where can I eat on campus?", "Is the cafeteria open on weekends?"],
+    ["What facilities are in the hostel area?", "Which one is for female students?"],
+    ["hello", "what can you do?", "where is computer lab 1?"],
+]
+
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"|value="([^"]+)"[^>]*name="csrf_token"')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def csrf_token(html):
+    match = CSRF_PATTERN.search(html)
+    return (match.group(1) or match.group(2)) if match else ""
+
+
+class Student:
+    """One simulated user with its own cookie session and chat session"""
+
+    def __init__(self, base_url, index, conversation):
+        self.base_url = base_url.rstrip("/")
+        self.username = f"load{index:04d}"
+        self.password = "loadtest-password"
+        self.conversation = itertools.cycle(conversation)
+        self.http = requests.Session()
+
+    def log_in(self):
+        page = self.http.get(f"{self.base_url}/register").text
+        self.http.post(f"{self.base_url}/register", data={
+            "csrf_token": csrf_token(page),
+            "username": self.username,
+            "email": f"{self.username}@example.com",
+            "full_name": f"Load Test {self.username}",
+            "student_id": "",
+            "role": "student",
+            "password": self.password,
+            "password2": self.password,
+        })  # Fails harmlessly when the user exists from an earlier run
+        page = self.http.get(f"{self.base_url}/login").text
+        self.http.post(f"{self.base_url}/login", data={
+            "csrf_token": csrf_token(page),
+            "username": self.username,
+            "password": self.password,
+        })
+        response = self.http.get(f"{self.base_url}/chatbot", allow_redirects=False)
+        if response.status_code != 200:
+            raise RuntimeError(f"{self.username} could not log in (status {response.status_code})")
+
+    def send(self, stream):
+        """Send the next message; returns (ok, latency s, time to first token s or None)"""
+        message = next(self.conversation)
+        started = time.perf_counter()
+        first_token = None
+        try:
+            if not stream:
+                response = self.http.post(f"{self.base_url}/api/chat", json={"message": message}, timeout=120)
+                ok = response.status_code == 200 and "error" not in response.json()
+                return ok, time.perf_counter() - started, None
+            ok = False
+            with self.http.post(f"{self.base_url}/api/chat/stream", json={"message": message},
+                                stream=True, timeout=120) as response:
+                if response.status_code != 200:
+                    return False, time.perf_counter() - started, None
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line.split(":", 1)[1].strip()
+                        if event == "token" and first_token is None:
+                            first_token = time.perf_counter() - started
+                        ok = ok or event == "done"
+                        if event == "error":
+                            ok = False
+            return ok, time.perf_counter() - started, first_token
+        except (requests.RequestException, ValueError):
+            return False, time.perf_counter() - started, first_token
+
+
+def run_load(base_url, users, rate, duration, stream=False):
+    """Drive the server and return a summary dict"""
+    students = [Student(base_url, i, CONVERSATIONS[i % len(CONVERSATIONS)]) for i in range(users)]
+    for student in students:
+        student.log_in()
+
+    results = []
+    results_lock = threading.Lock()
+    pending = [queue.Queue() for _ in students]
+
+    def student_loop(student, inbox):
+        while True:
+            if inbox.get() is None:
+                return
+            outcome = student.send(stream)
+            with results_lock:
+                results.append(outcome)
+
+    threads = [threading.Thread(target=student_loop, args=(s, q), daemon=True) for s, q in zip(students, pending)]
+    for thread in threads:
+        thread.start()
+
+    # Open-loop schedule: one message every 1/rate seconds, round-robin over the students
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < duration:
+        pending[sent % users].put(True)
+        sent += 1
+        time.sleep(max(0.0, started + sent / rate - time.perf_counter()))
+    for inbox in pending:
+        inbox.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for ok, latency, _ in results if ok)
+    first_tokens = sorted(ttft for ok, _, ttft in results if ok and ttft is not None)
+    errors = sum(1 for ok, _, _ in results if not ok)
+
+    def ms(value):
+        return round(value * 1000) if value is not None else None
+
+    return {
+        "target_rate": rate,
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else None,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "ttfb_p50_ms": ms(percentile(first_tokens, 0.50)),
+        "ttfb_p95_ms": ms(percentile(first_tokens, 0.95)),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def start_stub(args):
+    port = free_port()
+    command = [sys.executable, os.path.join(REPO_ROOT, "loadtest", "stub_llm.py"), "--port", str(port),
+               "--latency-ms", str(args.llm_latency_ms), "--tokens-per-second", str(args.llm_tokens_per_second),
+               "--error-rate", str(args.llm_error_rate)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+def run_config(config, llm_url, args):
+    """Start gunicorn with WORKERSxTHREADS on a fresh database, drive it, stop it"""
+    workers, threads = (int(part) for part in config.lower().split("x"))
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="chat-load-")
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+               DEEPSEEK_API_URL=llm_url,
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads))
+    subprocess.run([sys.executable, "-m", "flask", "--app", "main", "init-db", "--seed"],
+                   cwd=REPO_ROOT, env=env, check=True, capture_output=True)
+    log = open(os.path.join(workdir, "gunicorn.log"), "w")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "main:app"], cwd=REPO_ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for_port(port)
+        summary = run_load(f"http://127.0.0.1:{port}", args.users, args.rate, args.duration, args.stream)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        log.close()
+    return dict(config=config, **summary)
+
+
+def print_table(rows):
+    columns = ["config", "target_rate", "requests", "throughput_rps", "error_rate",
+               "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "ttfb_p95_ms"]
+    widths = {c: max(len(c), *(len(str(row.get(c))) for row in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c)).ljust(widths[c]) for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat endpoint load test")
+    parser.add_argument("--base-url", help="Drive an already running server instead of starting gunicorn")
+    parser.add_argument("--configs", default="2x1", help="Comma-separated gunicorn WORKERSxTHREADS to compare")
+    parser.add_argument("--users", type=int, default=10, help="Simulated students")
+    parser.add_argument("--rate", type=float, default=2.0, help="Target chat messages per second, all students together")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to send messages for")
+    parser.add_argument("--stream", action="store_true", help="Use /api/chat/stream and report time to first token")
+    parser.add_argument("--llm-url", help="Provider URL for started servers (default: start loadtest/stub_llm.py)")
+    parser.add_argument("--llm-latency-ms", type=float, default=400, help="Stub median time to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=60, help="Stub generation speed")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Stub share of failed requests")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines instead of a table")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        rows = [dict(config=args.base_url, **run_load(args.base_url, args.users, args.rate, args.duration, args.stream))]
+    else:
+        stub = None
+        llm_url = args.llm_url
+        if not llm_url:
+            stub, llm_url = start_stub(args)
+        try:
+            rows = [run_config(config.strip(), llm_url, args) for config in args.configs.split(",") if config.strip()]
+        finally:
+            if stub:
+                stub.terminate()
+
+    if args.json:
+        for row in rows:
+            print(json.dumps(row))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Mixed read/write benchmark for the SQLite settings.
+
+Several processes (standing in for gunicorn workers), each with several
+threads, run the app's own queries against one SQLite file for a fixed time:
+
+- reads: the active facility list and a session's recent chat messages
+- writes: a chat turn (two ChatMessage rows, one commit), like save_chat_turn
+
+Every profile gets a fresh, seeded database. `legacy` is SQLite's default
+rollback journal; `production` is the WAL profile from db_config.py.
+
+    python loadtest/sqlite_bench.py --processes 4 --threads 4 --duration 10 --write-ratio 0.2
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSIONS = 50
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def setup_database():
+    """Create and seed the database, plus one student with SESSIONS chat sessions"""
+    sys.path.insert(0, REPO_ROOT)
+    from flask_app import app, db, init_database
+    from models import ChatSession, User, UserRole
+    with app.app_context():
+        init_database(seed=True)
+        user = User(username="bench", email="bench@example.com", password_hash="x",
+                    full_name="Bench", role=UserRole.STUDENT)
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all(ChatSession(user_id=user.id, session_id=f"bench-{i}") for i in range(SESSIONS))
+        db.session.commit()
+
+
+def run_worker(threads, duration, write_ratio, results):
+    """One 'gunicorn worker': `threads` threads mixing reads and writes until time is up"""
+    sys.path.insert(0, REPO_ROOT)
+    from sqlalchemy.exc import OperationalError
+    from flask_app import app, db
+    from models import ChatMessage, ChatSession, Facility
+
+    with app.app_context():
+        session_ids = [s.id for s in ChatSession.query.all()]
+    latencies = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def loop():
+        with app.app_context():
+            while time.perf_counter() < stop_at:
+                kind = "write" if random.random() < write_ratio else "read"
+                session_id = random.choice(session_ids)
+                started = time.perf_counter()
+                try:
+                    if kind == "read":
+                        Facility.query.filter(Facility.is_active == True).all()
+                        ChatMessage.query.filter_by(session_id=session_id)\
+                            .order_by(ChatMessage.timestamp.desc()).limit(8).all()
+                        db.session.rollback()
+                    else:
+                        db.session.add(ChatMessage(session_id=session_id, message="where is the library", is_user=True))
+                        db.session.add(ChatMessage(session_id=session_id, message="Block B, Ground Floor", is_user=False))
+                        db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    with lock:
+                        errors[kind] += 1
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies[kind].append(elapsed)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put((latencies, errors))
+
+
+def run_profile(profile, args):
+    workdir = tempfile.mkdtemp(prefix="sqlite-bench-")
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        SQLITE_PROFILE=profile,
+        GUNICORN_THREADS=str(args.threads),
+        AUTO_INIT_DB="0",
+    )
+    context = multiprocessing.get_context("spawn")  # Children read the settings above at import
+    setup = context.Process(target=setup_database)
+    setup.start()
+    setup.join()
+
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, args=(args.threads, args.duration, args.write_ratio, results))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    reads = sorted(x for latencies, _ in collected for x in latencies["read"])
+    writes = sorted(x for latencies, _ in collected for x in latencies["write"])
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "profile": profile,
+        "ops_per_s": round((len(reads) + len(writes)) / args.duration),
+        "reads_per_s": round(len(reads) / args.duration),
+        "writes_per_s": round(len(writes) / args.duration),
+        "read_p95_ms": ms(percentile(reads, 0.95)),
+        "write_p95_ms": ms(percentile(writes, 0.95)),
+        "write_p99_ms": ms(percentile(writes, 0.99)),
+        "locked_errors": sum(errors["read"] + errors["write"] for _, errors in collected),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite mixed read/write benchmark")
+    parser.add_argument("--profiles", default="legacy,production", help="Comma-separated SQLITE_PROFILE values")
+    parser.add_argument("--processes", type=int, default=4, help="Worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per process")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per profile")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="Share of operations that write")
+    args = parser.parse_args(argv)
+
+    rows = [run_profile(profile.strip(), args) for profile in args.profiles.split(",") if profile.strip()]
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(row[c])) for row in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Local stand-in for an OpenAI-compatible chat-completions endpoint, for
+measuring the app without calling OpenRouter.
+
+    python loadtest/stub_llm.py --port 8900 --latency-ms 400 --tokens-per-second 60
+    DEEPSEEK_API_URL=http://127.0.0.1:8900/v1/chat/completions gunicorn main:app
+
+Each request waits a log-normally distributed time to first token (median
+--latency-ms, spread --latency-sigma), then produces tokens at
+--tokens-per-second, honouring max_tokens. A share of requests (--error-rate)
+fails with --error-status. Streaming requests get Server-Sent Events. Intent,
+classification and combined-mode prompts get valid JSON answers, so the app
+takes its normal code paths.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the library is open from eight in the morning until ten at night and you can "
+         "book a study room at the counter or online through the campus portal").split()
+
+INTENT_JSON = {"intent": "search", "entities": {"facility": "Library", "location": None,
+                                                 "issue_type": None, "component": None}, "confidence": 0.9}
+CLASSIFY_JSON = {"issue_type": "electrical", "priority": "medium", "reasoning": "Stub classification"}
+
+
+class StubSettings:
+    def __init__(self, args):
+        self.latency_ms = args.latency_ms
+        self.latency_sigma = args.latency_sigma
+        self.tokens_per_second = args.tokens_per_second
+        self.reply_tokens = args.reply_tokens
+        self.error_rate = args.error_rate
+        self.error_status = args.error_status
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def first_token_delay(self) -> float:
+        """Seconds before the first token: log-normal around the configured median"""
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.latency_ms / 1000), self.latency_sigma)
+
+
+def reply_content(body: dict, reply_tokens: int) -> list:
+    """The answer as a list of tokens (roughly one per word)"""
+    prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+    max_tokens = body.get("max_tokens") or (body.get("options") or {}).get("num_predict") or reply_tokens
+    if '"response"' in prompt:
+        answer = dict(INTENT_JSON, response=" ".join(WORDS[:min(reply_tokens, max_tokens)]))
+        return [json.dumps(answer)]
+    if "Classification Guidelines" in prompt:
+        return [json.dumps(CLASSIFY_JSON)]
+    if "extract entities" in prompt or body.get("response_format"):
+        return [json.dumps(INTENT_JSON)]
+    count = max(1, min(reply_tokens, max_tokens))
+    return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+
+def make_handler(settings: StubSettings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real provider
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, data: dict):
+            out = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def do_GET(self):
+            with settings.lock:
+                self.send_json(200, {"status": "ok", "requests": settings.requests, "errors": settings.errors})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with settings.lock:
+                settings.requests += 1
+                failed = random.random() < settings.error_rate
+                settings.errors += failed
+
+            time.sleep(settings.first_token_delay())
+            if failed:
+                self.send_json(settings.error_status, {"error": {"message": "stub provider error"}})
+                return
+
+            tokens = reply_content(body, settings.reply_tokens)
+            per_token = 1 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0
+            if body.get("stream"):
+                self.stream(tokens, per_token)
+                return
+            time.sleep(per_token * len(tokens))
+            self.send_json(200, {
+                "choices": [{"message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"completion_tokens": len(tokens)},
+            })
+
+        def stream(self, tokens: list, per_token: float):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_event(data: str):
+                frame = f"data: {data}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(frame), frame))
+                self.wfile.flush()
+
+            for token in tokens:
+                time.sleep(per_token)
+                write_event(json.dumps({"choices": [{"delta": {"content": token}, "finish_reason": None}]}))
+            write_event(json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]}))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=400, help="Median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal spread of the time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60, help="Generation speed after the first token (0 = instant)")
+    parser.add_argument("--reply-tokens", type=int, default=80, help="Length of prose replies, before max_tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of failed requests")
+    return parser.parse_args(argv)
+
+
+def serve(args) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubSettings(args)))
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = serve(args)
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
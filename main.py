@@ -3,7 +3,17 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from flask_app import app
+import os
+
+from flask_app import create_app, start_background_services
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    # Debug mode (with the reloader) unless FLASK_DEBUG=0
+    debug = os.environ.get("FLASK_DEBUG", "1") != "0"
+    # Job workers and cache warmup; the debug reloader runs this file twice, and
+    # only its child process (WERKZEUG_RUN_MAIN) serves requests
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services(app)
+    app.run(host="0.0.0.0", port=5000, debug=debug)
@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from llm_providers import get_adapter, infer_provider
+
+logger = logging.getLogger("llm")
+
+# Each LLM task gets its own model configuration, read from LLM_<TASK>_* with
+# the DEEPSEEK_* settings as defaults:
+#   intent   - intent and entity extraction (short JSON)
+#   classify - issue classification (short JSON)
+#   respond  - conversational replies, combined mode and history summaries
+TASKS = ("intent", "classify", "respond")
+
+
+class ModelConfig:
+    """Where and how to call one model"""
+
+    def __init__(self, url: str, model: str, key: str = None, max_tokens: int = None, provider: str = None):
+        self.url = url
+        self.model = model
+        self.key = key
+        self.max_tokens = max_tokens
+        self.provider = provider or infer_provider(url)
+        self.adapter = get_adapter(self.provider)
+
+    def token_cap(self, requested: int) -> int:
+        """The caller's token count, limited by this model's cap if one is set"""
+        return min(requested, self.max_tokens) if self.max_tokens else requested
+
+    def __repr__(self):
+        return f"<ModelConfig {self.provider}:{self.model} @ {self.url}>"
+
+
+class LatencyWindow:
+    """Call latencies of the last `window_seconds`, for a rolling p95"""
+
+    def __init__(self, window_seconds: float = 300, max_samples: int = 500):
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=max_samples)  # (time.monotonic(), latency ms)
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms: float):
+        with self._lock:
+            self.samples.append((time.monotonic(), latency_ms))
+
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            while self.samples and self.samples[0][0] < cutoff:
+                self.samples.popleft()
+            return sorted(ms for _, ms in self.samples)
+
+    def percentile(self, p: float, min_samples: int = 1):
+        latencies = self._recent()
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+class ModelRouter:
+    """
+    Picks the model for one task. With a fallback and a p95 budget configured,
+    the task moves to the fallback while the primary model's rolling p95 is
+    over budget. Primary samples age out of the window while it is not used,
+    so after `window_seconds` the primary is tried again.
+    """
+
+    def __init__(self, task: str, primary: ModelConfig, fallback: ModelConfig = None,
+                 p95_budget_ms: float = None, window_seconds: float = 300, min_samples: int = 10):
+        self.task = task
+        self.primary = primary
+        self.fallback = fallback
+        self.p95_budget_ms = p95_budget_ms
+        self.min_samples = min_samples
+        self.latency = {id(primary): LatencyWindow(window_seconds)}
+        if fallback:
+            self.latency[id(fallback)] = LatencyWindow(window_seconds)
+        self.calls = {"primary": 0, "fallback": 0}
+        self.using_fallback = False
+
+    def choose(self) -> ModelConfig:
+        if self.fallback and self.p95_budget_ms:
+            p95 = self.latency[id(self.primary)].percentile(0.95, self.min_samples)
+            over_budget = p95 is not None and p95 > self.p95_budget_ms
+            if over_budget != self.using_fallback:
+                self.using_fallback = over_budget
+                if over_budget:
+                    logger.warning("LLM task %s: %s p95 %.0f ms over the %.0f ms budget; switching to %s",
+                                   self.task, self.primary.model, p95, self.p95_budget_ms, self.fallback.model)
+                else:
+                    logger.warning("LLM task %s: switching back to %s", self.task, self.primary.model)
+        return self.fallback if self.using_fallback else self.primary
+
+    def record(self, config: ModelConfig, latency_ms: float, outcome: str):
+        """Record one finished call (failures too: timeouts are the slowest calls of all)"""
+        self.latency[id(config)].add(latency_ms)
+        self.calls["fallback" if config is self.fallback else "primary"] += 1
+        logger.info("LLM task=%s model=%s latency_ms=%.0f outcome=%s", self.task, config.model, latency_ms, outcome)
+
+    def stats(self) -> dict:
+        def p95(config):
+            value = self.latency[id(config)].percentile(0.95)
+            return round(value, 1) if value is not None else None
+
+        stats = {
+            "provider": self.primary.provider,
+            "model": self.primary.model,
+            "max_tokens": self.primary.max_tokens,
+            "p95_ms": p95(self.primary),
+            "calls": self.calls["primary"],
+        }
+        if self.fallback:
+            stats["fallback"] = {
+                "provider": self.fallback.provider,
+                "model": self.fallback.model,
+                "p95_budget_ms": self.p95_budget_ms,
+                "active": self.using_fallback,
+                "p95_ms": p95(self.fallback),
+                "calls": self.calls["fallback"],
+            }
+        return stats
+
+
+def _env(task: str, name: str, default=None):
+    return os.environ.get(f"LLM_{task.upper()}_{name}") or default
+
+
+def router_from_env(task: str, default_url: str, default_model: str, default_key: str = None) -> ModelRouter:
+    """
+    Build a task's router from LLM_<TASK>_MODEL/_URL/_KEY/_MAX_TOKENS/_PROVIDER
+    and the _FALLBACK_* variants. The provider (openai, ollama or stub) falls
+    back to LLM_PROVIDER, then to a guess from the URL.
+    """
+    max_tokens = _env(task, "MAX_TOKENS")
+    primary = ModelConfig(
+        url=_env(task, "URL", default_url),
+        model=_env(task, "MODEL", default_model),
+        key=_env(task, "KEY", default_key),
+        max_tokens=int(max_tokens) if max_tokens else None,
+        provider=_env(task, "PROVIDER", os.environ.get("LLM_PROVIDER")),
+    )
+    fallback = None
+    if _env(task, "FALLBACK_MODEL"):
+        fallback = ModelConfig(
+            url=_env(task, "FALLBACK_URL", primary.url),
+            model=_env(task, "FALLBACK_MODEL"),
+            key=_env(task, "FALLBACK_KEY", primary.key),
+            max_tokens=primary.max_tokens,
+            provider=_env(task, "FALLBACK_PROVIDER", os.environ.get("LLM_PROVIDER")),
+        )
+    budget = _env(task, "P95_BUDGET_MS")
+    return ModelRouter(
+        task, primary, fallback,
+        p95_budget_ms=float(budget) if budget else None,
+        window_seconds=float(os.environ.get("LLM_SLO_WINDOW_SECONDS", "300")),
+        min_samples=int(os.environ.get("LLM_SLO_MIN_SAMPLES", "10")),
+    )
@@ -58,6 +58,19 @@ class Facility(db.Model):
 
 class Issue(db.Model):
     __tablename__ = 'issues'
+    __table_args__ = (
+        # Student dashboard: a student's issues, newest first, and their counts
+        db.Index('ix_issues_user_created', 'user_id', 'created_at'),
+        # Admin dashboard: counts per status
+        db.Index('ix_issues_status_created', 'status', 'created_at'),
+        # Admin dashboard: the newest issues overall
+        db.Index('ix_issues_created_at', 'created_at'),
+        # Issue queue pages (priority, then oldest first), unfiltered and per filter
+        db.Index('ix_issues_priority_created', 'priority', 'created_at', 'id'),
+        db.Index('ix_issues_status_priority_created', 'status', 'priority', 'created_at', 'id'),
+        db.Index('ix_issues_type_priority_created', 'issue_type', 'priority', 'created_at', 'id'),
+        db.Index('ix_issues_facility_priority_created', 'facility_id', 'priority', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -89,25 +102,39 @@ class Issue(db.Model):
 
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
+    __table_args__ = (
+        # Every chat turn looks its session up by the client's session_id
+        db.Index('ix_chat_sessions_session_id', 'session_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     session_id = db.Column(db.String(50), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Rolling summary of the older turns that no longer fit in the prompt
+    summary = db.Column(db.Text)
+    summarized_count = db.Column(db.Integer, default=0)  # Number of history messages folded into summary
+    
     # Relationships
     user = db.relationship('User')
     messages = db.relationship('ChatMessage', back_populates="session")
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Serves the per-turn "recent messages of this session" window query
+        db.Index('ix_chat_messages_session_timestamp', 'session_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, nullable=False)  # True for user, False for bot
     intent = db.Column(db.String(50))  # Detected intent
+    intent_source = db.Column(db.String(20))  # Who labelled it: llm, local (fast path), template, admin
     entities = db.Column(db.JSON)  # Extracted entities
+    llm_stats = db.Column(db.JSON)  # Bot replies: LLM latency, tokens and outcomes of the turn
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -121,6 +148,19 @@ class BookingStatus(enum.Enum):
 
 class FacilityBooking(db.Model):
     __tablename__ = 'facility_bookings'
+    __table_args__ = (
+        # Booking conflict check and the facility schedule
+        db.Index('ix_facility_bookings_facility_date_status', 'facility_id', 'booking_date', 'status'),
+        # My bookings, in date and start hour order
+        db.Index('ix_facility_bookings_user_date', 'user_id', 'booking_date', 'start_hour'),
+        # Admin dashboard: counts per status, and the newest bookings
+        db.Index('ix_facility_bookings_status', 'status'),
+        db.Index('ix_facility_bookings_created_at', 'created_at'),
+        # Manage bookings pages (latest date first), unfiltered and per filter
+        db.Index('ix_facility_bookings_date_hour', 'booking_date', 'start_hour', 'id'),
+        db.Index('ix_facility_bookings_status_date_hour', 'status', 'booking_date', 'start_hour', 'id'),
+        db.Index('ix_facility_bookings_facility_date_hour', 'facility_id', 'booking_date', 'start_hour', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     facility_id = db.Column(db.Integer, db.ForeignKey('facilities.id'), nullable=False)
@@ -147,4 +187,57 @@ class FacilityBooking(db.Model):
     
     @property
     def time_slot_display(self):
-        return f"{self.start_hour:02d}:00 - {self.end_hour:02d}:00"
\ No newline at end of file
+        return f"{self.start_hour:02d}:00 - {self.end_hour:02d}:00"
+
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+class Job(db.Model):
+    """Deferred background work, processed by job_queue workers"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Serves the worker's "next runnable job" query
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON)
+    status = db.Column(Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # Visibility timeout: job is re-claimable after this
+    locked_by = db.Column(db.String(100))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status.value}>'
+
+class CacheVersion(db.Model):
+    """Version counters for data cached in each worker process; bumped whenever the data changes"""
+    __tablename__ = 'cache_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class StatusCount(db.Model):
+    """Rows per status of a table, overall (user_id 0) and per user; kept current by status_counts"""
+    __tablename__ = 'status_counts'
+    
+    name = db.Column(db.String(50), primary_key=True)  # Counted table, e.g. 'issues'
+    user_id = db.Column(db.Integer, primary_key=True)  # 0 for all users
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<StatusCount {self.name}/{self.user_id}/{self.status}={self.count}>'
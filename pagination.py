@@ -0,0 +1,76 @@
+import base64
+import enum
+import json
+from datetime import date, datetime
+from sqlalchemy import tuple_
+
+# Keyset (cursor) pagination for the admin lists. A page is "the next N rows
+# after the last row of the previous page" in a fixed order ending in the
+# primary key, so with an index in that order every page costs the same
+# however far into the table it is, unlike OFFSET which reads every row it
+# skips. The cursor is the sort key of that last row, passed back as an
+# opaque ?after= token.
+
+def encode_cursor(values) -> str:
+    """URL-safe token for a row's sort key (dates as ISO strings, enums as their values)"""
+    plain = [v.isoformat() if isinstance(v, (date, datetime)) else v.value if isinstance(v, enum.Enum) else v
+             for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode().rstrip("=")
+
+def decode_cursor(token, types):
+    """Sort key from encode_cursor, converted with `types`; None for a missing or malformed token"""
+    if not token:
+        return None
+    try:
+        plain = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if len(plain) != len(types):
+            return None
+        return [None if value is None else convert(value) for convert, value in zip(types, plain)]
+    except (ValueError, TypeError):
+        return None
+
+def keyset_query(query, columns, cursor, limit, descending=False):
+    """`query` limited to the `limit` rows after `cursor` in `columns` order"""
+    key = tuple_(*columns)
+    if cursor is not None:
+        query = query.filter(key < tuple_(*cursor) if descending else key > tuple_(*cursor))
+        # Same bound on the first column alone, which the planner can combine with other range filters on it
+        query = query.filter(columns[0] <= cursor[0] if descending else columns[0] >= cursor[0])
+    return query.order_by(*[c.desc() if descending else c for c in columns]).limit(limit)
+
+def keyset_page(query, columns, cursor, per_page, descending=False):
+    """
+    Rows of `query` after `cursor` in `columns` order (all ascending or all
+    descending, the last one unique). Returns (rows, sort key of the last row
+    if there is a next page, else None).
+    """
+    rows = keyset_query(query, columns, cursor, per_page + 1, descending).all()
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, [getattr(rows[-1], c.key) for c in columns]
+
+def grouped_keyset_page(query, group_column, groups, columns, cursor, per_page):
+    """
+    keyset_page over several groups shown one after another (e.g. priorities,
+    most urgent first), each in ascending `columns` order. One indexed query
+    per group reached; the cursor is (group, *columns).
+    """
+    def in_group(group):
+        return query.filter(group_column.is_(None) if group is None else group_column == group)
+
+    rows = []
+    start = groups.index(cursor[0]) if cursor is not None and cursor[0] in groups else 0
+    for group in groups[start:]:
+        group_cursor = cursor[1:] if cursor is not None and group == cursor[0] else None
+        page, next_key = keyset_page(in_group(group), columns, group_cursor, per_page - len(rows))
+        rows.extend(page)
+        if next_key is not None:
+            return rows, [group] + next_key
+        if len(rows) == per_page:
+            # Page full at the end of a group: is there anything in the later ones?
+            later = groups[groups.index(group) + 1:]
+            if any(in_group(g).limit(1).first() for g in later):
+                return rows, [group] + [getattr(rows[-1], c.key) for c in columns]
+            return rows, None
+    return rows, None
@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+from flask import g, url_for
+from flask_login import login_user
+
+from flask_app import app, db
+from models import BookingStatus, Facility, FacilityBooking, Issue, IssueType, User, UserRole
+
+# N+1 check for the list pages, for `flask --app main check-query-counts` and
+# tests/test_query_counts.py.
+# Each page is rendered with N and then 2N issues and bookings, each row by a
+# different user on a different facility, and the SQL statements it runs are
+# counted. A page whose statement count grows with the rows loads a relation
+# (or runs a query) per row instead of eager-loading it. N stays below the
+# dashboards' "recent" limits (3 to 10 rows), or they would show N rows both times.
+#
+# The rows only live in the command's transaction, which is rolled back at
+# the end. Existing issues and bookings can push them off the pages, so the
+# check is meant for a fresh database.
+
+# (endpoint, view arguments, who looks at it); "facility" is the first facility added
+LIST_PAGES = [
+    ("student_dashboard", {}, UserRole.STUDENT),
+    ("my_bookings", {}, UserRole.STUDENT),
+    # Admins see who booked each slot
+    ("facility_schedule", {"facility_id": "facility"}, UserRole.ADMIN),
+    ("admin_dashboard", {}, UserRole.ADMIN),
+    ("manage_bookings", {}, UserRole.ADMIN),
+    ("issue_queue", {}, UserRole.ADMIN),
+]
+
+
+def add_rows(count: int, student: User, start: int = 0, first: Facility = None) -> Facility:
+    """
+    `count` facilities, each with an issue and a booking by a new user, plus
+    one issue and one booking by `student` on each. Every new user also books
+    `first` (by default the first facility added), for its schedule. Flushed,
+    not committed; returns `first`.
+    """
+    for i in range(start, start + count):
+        facility = Facility(name=f"Query count facility {i}", category="Test", location=f"Block {i}",
+                            is_bookable=True)
+        user = User(username=f"query_count_user_{i}", email=f"query_count_{i}@example.com", password_hash="-",
+                    full_name=f"Query Count User {i}", role=UserRole.STUDENT)
+        first = first or facility
+        day = date.today() + timedelta(days=i % 28)
+        db.session.add_all([
+            facility, user,
+            Issue(title=f"Issue {i}", description="-", issue_type=IssueType.OTHER, location=facility.location,
+                  facility=facility, reporter=user),
+            Issue(title=f"Issue {i} by student", description="-", issue_type=IssueType.OTHER,
+                  location=facility.location, facility=facility, reporter=student),
+            FacilityBooking(facility=facility, user=student, booking_date=day, start_hour=9, end_hour=10,
+                            purpose="-", status=BookingStatus.PENDING),
+            FacilityBooking(facility=first, user=user, booking_date=day, start_hour=11, end_hour=12,
+                            purpose="-", status=BookingStatus.APPROVED),
+        ])
+    db.session.flush()
+    return first
+
+
+def compare_statement_counts(rows: int) -> tuple:
+    """
+    ({endpoint: statements with `rows` rows}, {endpoint: statements with twice
+    as many}); everything added is rolled back.
+    """
+    users = {
+        UserRole.STUDENT: User(username="query_count_student", email="query_count_student@example.com",
+                               password_hash="-", full_name="Query Count Student", role=UserRole.STUDENT),
+        UserRole.ADMIN: User(username="query_count_admin", email="query_count_admin@example.com",
+                             password_hash="-", full_name="Query Count Admin", role=UserRole.ADMIN),
+    }
+    db.session.add_all(users.values())
+    try:
+        facility = add_rows(rows, users[UserRole.STUDENT])
+        user_ids = {role: user.id for role, user in users.items()}
+        facility_id = facility.id
+        before = statement_counts(user_ids, facility_id)
+        student, facility = db.session.get(User, user_ids[UserRole.STUDENT]), db.session.get(Facility, facility_id)
+        add_rows(rows, student, start=rows, first=facility)
+        after = statement_counts(user_ids, facility_id)
+    finally:
+        db.session.rollback()
+    return before, after
+
+
+def statement_counts(user_ids: dict, facility_id: int) -> dict:
+    """{endpoint: SQL statements} for rendering each list page in the current transaction"""
+    counts = {}
+    for endpoint, view_args, role in LIST_PAGES:
+        view_args = {key: facility_id if value == "facility" else value for key, value in view_args.items()}
+        with app.test_request_context():
+            path = url_for(endpoint, **view_args)
+        # Like a new request: related rows already in the session would be lazy-loaded without SQL
+        db.session.expunge_all()
+        user = db.session.get(User, user_ids[role])
+        # Pushed inside the command's app context, so the request shares its session and sees the rows
+        with app.test_request_context(path):
+            login_user(user)
+            g.sql_statements = 0
+            response = app.full_dispatch_request()
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            counts[endpoint] = g.sql_statements
+    return counts
@@ -0,0 +1,127 @@
+import re
+from datetime import date, datetime
+
+from sqlalchemy import func, select
+
+from models import BookingStatus, ChatMessage, ChatSession, FacilityBooking, Issue, Priority, User
+from status_counts import ISSUES, counts_query
+from pagination import keyset_query
+from routes import (ADMIN_PAGE_SIZE, BOOKING_LIST_OPTIONS, BOOKING_LIST_ORDER, ISSUE_LIST_OPTIONS,
+                    ISSUE_QUEUE_OPTIONS, ISSUE_QUEUE_ORDER, filter_bookings, filter_issues)
+
+# The hot queries of routes.py (and the per-turn chat history query), in the
+# same shape the routes build them, for `flask --app main check-query-plans`.
+# Each one must be answered from an index: a plain "SCAN <table>" in its
+# SQLite query plan means it reads the whole table on every request.
+#
+# Left out on purpose: the facilities list, a small reference table that the
+# AI service caches anyway.
+#
+# The keyset-paginated admin pages must also come out of an index already in
+# order: a "USE TEMP B-TREE" sort would read every matching row for each page.
+
+# "SCAN issues" (or "SCAN TABLE issues" on older SQLite), but not "SCAN issues USING INDEX ..."
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+
+
+def _count(query):
+    """The statement Query.count() runs"""
+    return select(func.count()).select_from(query.statement.subquery())
+
+
+def hot_queries():
+    """(name, statement) pairs; parameter values do not change SQLite's plan"""
+    today = date.today()
+    active = [BookingStatus.PENDING, BookingStatus.APPROVED]
+    chat_messages = ChatMessage.query.filter_by(session_id=1)
+    return [
+        ("login: user by username", User.query.filter_by(username="x").limit(1)),
+        ("chat: session by session_id", ChatSession.query.filter_by(session_id="x").limit(1)),
+        ("chat: history count", _count(chat_messages)),
+        ("chat: history window", chat_messages.order_by(ChatMessage.timestamp, ChatMessage.id).offset(0).limit(8)),
+        ("student dashboard: recent issues",
+         Issue.query.filter_by(user_id=1).order_by(Issue.created_at.desc()).limit(5)),
+        ("student dashboard: recent bookings",
+         FacilityBooking.query.filter_by(user_id=1).options(*BOOKING_LIST_OPTIONS)
+         .order_by(FacilityBooking.created_at.desc()).limit(3)),
+        ("student dashboard: status counts", counts_query(ISSUES, 1)),
+        ("admin dashboard: recent issues", Issue.query.options(*ISSUE_LIST_OPTIONS).order_by(Issue.created_at.desc()).limit(10)),
+        ("admin dashboard: recent bookings",
+         FacilityBooking.query.options(*BOOKING_LIST_OPTIONS)
+         .order_by(FacilityBooking.created_at.desc()).limit(5)),
+        ("admin dashboard: status counts", counts_query(ISSUES)),
+        ("book facility: conflict check",
+         FacilityBooking.query.filter_by(facility_id=1, booking_date=today).filter(
+             FacilityBooking.start_hour < 10,
+             FacilityBooking.end_hour > 9,
+             FacilityBooking.status.in_(active)
+         ).limit(1)),
+        ("my bookings", FacilityBooking.query.filter_by(user_id=1).options(*BOOKING_LIST_OPTIONS).order_by(
+            FacilityBooking.booking_date.desc(),
+            FacilityBooking.start_hour.desc()
+        )),
+        ("facility schedule", FacilityBooking.query.filter(
+            FacilityBooking.facility_id == 1,
+            FacilityBooking.booking_date >= today,
+            FacilityBooking.booking_date <= today,
+            FacilityBooking.status.in_(active)
+        ).options(*BOOKING_LIST_OPTIONS).order_by(FacilityBooking.booking_date, FacilityBooking.start_hour)),
+    ]
+
+
+def paged_queries():
+    """(name, statement) pairs for the first and a later page of each admin list and filter"""
+    booking_filters = [
+        ("all", {}),
+        ("status", {"status": "pending"}),
+        ("facility", {"facility_id": "1"}),
+        ("date range", {"date_from": "2025-01-01", "date_to": "2025-12-31"}),
+    ]
+    issue_filters = [
+        ("all", {}),
+        ("status", {"status": "reported"}),
+        ("type", {"issue_type": "electrical"}),
+        ("facility", {"facility_id": "1"}),
+    ]
+    queries = []
+    for label, args in booking_filters:
+        for page, cursor in (("first", None), ("later", [date(2025, 6, 1), 9, 100])):
+            query = filter_bookings(FacilityBooking.query.options(*BOOKING_LIST_OPTIONS), _Args(args), cursor)
+            queries.append((f"manage bookings: {label}, {page} page",
+                            keyset_query(query, BOOKING_LIST_ORDER, cursor, ADMIN_PAGE_SIZE + 1, descending=True)))
+    for label, args in issue_filters:
+        query = filter_issues(Issue.query.options(*ISSUE_QUEUE_OPTIONS), _Args(args))
+        # One query per priority reached; they only differ in the priority value
+        group = query.filter(Issue.priority == Priority.HIGH)
+        for page, cursor in (("first", None), ("later", [datetime.utcnow(), 100])):
+            queries.append((f"issue queue: {label}, {page} page",
+                            keyset_query(group, ISSUE_QUEUE_ORDER, cursor, ADMIN_PAGE_SIZE + 1)))
+    return queries
+
+
+class _Args(dict):
+    """Stands in for request.args"""
+    def get(self, key, default=None, type=None):
+        value = super().get(key, default)
+        return type(value) if type is not None and value is not None else value
+
+
+def explain(conn, statement) -> list:
+    """SQLite's EXPLAIN QUERY PLAN detail lines for a Query or statement"""
+    statement = getattr(statement, "statement", statement)
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = tuple(None for _ in compiled.positiontup or ())
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan: list, tables: set) -> list:
+    """Tables the plan reads in full, without an index"""
+    scanned = [m.group(1) for m in map(FULL_SCAN.match, plan) if m]
+    # Eagerly joined tables appear under SQLAlchemy's aliases, e.g. "users_1"
+    return [name for name in scanned if re.sub(r"_\d+$", "", name) in tables or name in tables]
+
+
+def sorts(plan: list) -> list:
+    """Plan lines where SQLite sorts rows itself instead of reading them in index order"""
+    return [line for line in plan if line.startswith("USE TEMP B-TREE")]
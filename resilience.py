@@ -0,0 +1,184 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+# Absolute time.monotonic() by which every LLM call of the current request must finish.
+# A ContextVar follows the request through its thread (and into copied contexts).
+_deadline = ContextVar("llm_deadline", default=None)
+# Cancellation token shared by the calls of one request, including work it handed to a pool
+_cancel_token = ContextVar("llm_cancel_token", default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The request's LLM time budget is spent. A Timeout, so callers fall back as they do for timeouts."""
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """The provider circuit is open; the call was refused without contacting the provider."""
+
+
+class RequestCancelled(requests.exceptions.RequestException):
+    """The request that wanted this LLM call no longer needs it."""
+
+
+class CancelToken:
+    """Per-request flag checked before each provider call and between streamed chunks"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+@contextmanager
+def cancel_scope(token):
+    """Make `token` the cancellation token of LLM calls inside the block"""
+    reset = _cancel_token.set(token)
+    try:
+        yield token
+    finally:
+        _cancel_token.reset(reset)
+
+
+def raise_if_cancelled():
+    token = _cancel_token.get()
+    if token is not None and token.cancelled:
+        raise RequestCancelled("LLM call cancelled by its request")
+
+
+@contextmanager
+def provider_slot(semaphore):
+    """
+    Hold one of the process-wide provider slots for the duration of a call.
+    Waiting for a slot counts against the request's deadline.
+    """
+    remaining = remaining_time()
+    if not semaphore.acquire(timeout=None if remaining is None else max(0, remaining)):
+        raise DeadlineExceeded("LLM deadline exceeded waiting for a provider slot")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+@contextmanager
+def deadline_scope(seconds):
+    """Share one time budget across all LLM calls made inside the block"""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left in the current deadline, or None if no deadline is set"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def bounded_timeout(connect_timeout, read_timeout):
+    """(connect, read) timeout pair clipped to the current deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return (connect_timeout, read_timeout)
+    if remaining <= 0.05:
+        raise DeadlineExceeded("LLM deadline exceeded before the call started")
+    return (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    """Exponential backoff with full jitter (attempt starts at 1)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def is_retryable(error):
+    """429, 5xx, connection errors and timeouts are retried; other client errors are not"""
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status == 429 or (status is not None and status >= 500)
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures. While open,
+    calls fail immediately. After `recovery_timeout` seconds one probe call is
+    let through (half-open): success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.trips = 0
+        self.rejected_calls = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the call may go ahead"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError("LLM provider circuit is open")
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.probe_in_flight:
+                    self.rejected_calls += 1
+                    raise CircuitOpenError("LLM provider circuit is half-open; probe in progress")
+                self.probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """Release a half-open probe slot when the call ended without a verdict (e.g. a 4xx)"""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected_calls": self.rejected_calls,
+            }
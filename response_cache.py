@@ -0,0 +1,121 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CONTRACTIONS = {
+    "where's": "where is",
+    "what's": "what is",
+    "when's": "when is",
+    "how's": "how is",
+    "who's": "who is",
+    "it's": "it is",
+    "there's": "there is",
+    "i'm": "i am",
+    "can't": "cannot",
+    "don't": "do not",
+    "isn't": "is not",
+}
+
+_APOSTROPHES = re.compile(r"[‘’`]")
+_NON_WORD = re.compile(r"[^a-z0-9\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """
+    Canonical form of a chat message for cache lookups, so that
+    "Where's Computer Lab 1" and "where is computer lab 1?" share an entry.
+    """
+    text = _APOSTROPHES.sub("'", (text or "").lower())
+    for short, full in CONTRACTIONS.items():
+        text = text.replace(short, full)
+    text = _NON_WORD.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def context_digest(user_context) -> str:
+    """
+    Digest of the conversation a reply is written in (rolling summary plus
+    verbatim history), or "" for a first turn. Follow-ups like "where is it?"
+    mean something different in every conversation.
+    """
+    summary = (user_context or {}).get("summary") or ""
+    history = [(m.get("sender"), m.get("text")) for m in (user_context or {}).get("history") or []]
+    if not summary and not history:
+        return ""
+    return hashlib.sha256(json.dumps([summary, history]).encode()).hexdigest()
+
+
+def make_cache_key(user_message: str, intent_data: dict, user_context=None) -> tuple:
+    """Cache key from the normalized message, the detected intent and entities, and the conversation so far."""
+    entities = intent_data.get("entities") or {}
+    entity_items = tuple(sorted(
+        (name, normalize_message(str(value)))
+        for name, value in entities.items() if value
+    ))
+    return (normalize_message(user_message), intent_data.get("intent") or "general_info", entity_items,
+            context_digest(user_context))
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with a per-entry time to live. Entries are kept in
+    an OrderedDict in least- to most-recently-used order.
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value, or None on a miss or an expired entry."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after facility data changed."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
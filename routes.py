@@ -1,12 +1,98 @@
 import uuid
-from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, jsonify, session, Blueprint, send_from_directory
+import json
+import hmac
+import math
+from datetime import date, datetime
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, Blueprint, send_from_directory, Response, stream_with_context
 import os
+import logging
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_app import app, db, bcrypt
 from models import User, Issue, Facility, ChatSession, ChatMessage, IssueStatus, IssueType, Priority, UserRole, FacilityBooking, BookingStatus
 from forms import LoginForm, RegistrationForm, IssueForm, FeedbackForm, BookingForm, BookingManagementForm, FacilityForm, FacilityManagementForm
 from ai_service import ai_service
+from job_queue import enqueue, queue_depth
+from resilience import deadline_scope
+from llm_metrics import mark_chat_mode, record_turn
+from cache_versions import FACILITIES, bump_version
+from status_counts import ISSUES, BOOKINGS, read_counts, rebuild_counts
+from db_config import sql_statement_count
+from sqlalchemy.orm import joinedload
+from pagination import decode_cursor, encode_cursor, grouped_keyset_page, keyset_page
+
+# List pages show each booking's facility and student, and each issue's reporter.
+# Load them in the list query itself (only the columns the templates show)
+# instead of one lazy SELECT per row.
+BOOKING_LIST_OPTIONS = (
+    joinedload(FacilityBooking.facility).load_only(Facility.name, Facility.location),
+    joinedload(FacilityBooking.user).load_only(User.full_name, User.username),
+)
+ISSUE_LIST_OPTIONS = (
+    joinedload(Issue.reporter).load_only(User.full_name),
+)
+ISSUE_QUEUE_OPTIONS = ISSUE_LIST_OPTIONS + (
+    joinedload(Issue.facility).load_only(Facility.name),
+)
+
+# Admin list pages are keyset-paginated (see pagination.py); each order has matching indexes in models.py
+ADMIN_PAGE_SIZE = 50
+BOOKING_LIST_ORDER = (FacilityBooking.booking_date, FacilityBooking.start_hour, FacilityBooking.id)  # Descending
+ISSUE_QUEUE_PRIORITIES = [Priority.URGENT, Priority.HIGH, Priority.MEDIUM, Priority.LOW, None]
+ISSUE_QUEUE_ORDER = (Issue.created_at, Issue.id)  # Oldest first within a priority
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def filter_bookings(query, args, cursor=None):
+    """Apply the manage bookings filters (status, facility_id, date_from, date_to) from request args"""
+    status = args.get('status', '')
+    if status in [s.value for s in BookingStatus]:
+        query = query.filter(FacilityBooking.status == BookingStatus(status))
+    facility_id = args.get('facility_id', type=int)
+    if facility_id:
+        query = query.filter(FacilityBooking.facility_id == facility_id)
+    date_from = _parse_date(args.get('date_from'))
+    if date_from:
+        query = query.filter(FacilityBooking.booking_date >= date_from)
+    date_to = _parse_date(args.get('date_to'))
+    if date_to and not (cursor and cursor[0] <= date_to):
+        # Past the first page the cursor bounds booking_date more tightly; one upper bound keeps the index range exact
+        query = query.filter(FacilityBooking.booking_date <= date_to)
+    return query
+
+def filter_issues(query, args):
+    """Apply the issue queue filters (status, issue_type, facility_id) from request args"""
+    status = args.get('status', '')
+    if status in [s.value for s in IssueStatus]:
+        query = query.filter(Issue.status == IssueStatus(status))
+    issue_type = args.get('issue_type', '')
+    if issue_type in [t.value for t in IssueType]:
+        query = query.filter(Issue.issue_type == IssueType(issue_type))
+    facility_id = args.get('facility_id', type=int)
+    if facility_id:
+        query = query.filter(Issue.facility_id == facility_id)
+    return query
+
+def _page_url(endpoint, after=None):
+    """Link to the page after the `after` sort key (the first page if None), keeping the current filters"""
+    filters = {k: v for k, v in request.args.items() if k != 'after' and v}
+    if after is not None:
+        filters['after'] = encode_cursor(after)
+    return url_for(endpoint, **filters)
+
+@app.after_request
+def report_sql_statements(response):
+    """Expose the request's SQL statement count (X-SQL-Statements) and log requests that run too many"""
+    count = sql_statement_count()
+    if os.environ.get('SQL_STATEMENT_HEADER', '0') == '1':
+        response.headers['X-SQL-Statements'] = str(count)
+    limit = int(os.environ.get('SQL_STATEMENT_WARN') or 0)
+    if limit and count > limit:
+        logging.warning(f"{request.method} {request.path} ran {count} SQL statements (SQL_STATEMENT_WARN={limit})")
+    return response
 
 docs_bp = Blueprint('docs', __name__, url_prefix='/docs')
 
@@ -92,12 +178,14 @@ def student_dashboard():
     
     # Get user's recent bookings
     recent_bookings = FacilityBooking.query.filter_by(user_id=current_user.id)\
+                                          .options(*BOOKING_LIST_OPTIONS)\
                                           .order_by(FacilityBooking.created_at.desc())\
                                           .limit(3).all()
     
     # Get statistics
-    total_issues = Issue.query.filter_by(user_id=current_user.id).count()
-    resolved_issues = Issue.query.filter_by(user_id=current_user.id, status=IssueStatus.RESOLVED).count()
+    issue_counts = read_counts(db.session.connection(), ISSUES, current_user.id)
+    total_issues = sum(issue_counts.values())
+    resolved_issues = issue_counts.get(IssueStatus.RESOLVED.value, 0)
     
     return render_template('student_dashboard.html', 
                          recent_issues=recent_issues,
@@ -113,21 +201,24 @@ def admin_dashboard():
         return redirect(url_for('index'))
     
     # Get recent issues for admin
-    recent_issues = Issue.query.order_by(Issue.created_at.desc()).limit(10).all()
+    recent_issues = Issue.query.options(*ISSUE_LIST_OPTIONS).order_by(Issue.created_at.desc()).limit(10).all()
     
     # Get recent bookings for admin
-    recent_bookings = FacilityBooking.query.order_by(FacilityBooking.created_at.desc()).limit(5).all()
+    recent_bookings = FacilityBooking.query.options(*BOOKING_LIST_OPTIONS)\
+                                          .order_by(FacilityBooking.created_at.desc()).limit(5).all()
     
-    # Get statistics
-    total_issues = Issue.query.count()
-    pending_issues = Issue.query.filter_by(status=IssueStatus.REPORTED).count()
-    in_progress_issues = Issue.query.filter_by(status=IssueStatus.IN_PROGRESS).count()
-    resolved_issues = Issue.query.filter_by(status=IssueStatus.RESOLVED).count()
+    # Get statistics (kept in the status_counts table, see status_counts.py)
+    issue_counts = read_counts(db.session.connection(), ISSUES)
+    total_issues = sum(issue_counts.values())
+    pending_issues = issue_counts.get(IssueStatus.REPORTED.value, 0)
+    in_progress_issues = issue_counts.get(IssueStatus.IN_PROGRESS.value, 0)
+    resolved_issues = issue_counts.get(IssueStatus.RESOLVED.value, 0)
     
     # Get booking statistics
-    total_bookings = FacilityBooking.query.count()
-    pending_bookings = FacilityBooking.query.filter_by(status=BookingStatus.PENDING).count()
-    approved_bookings = FacilityBooking.query.filter_by(status=BookingStatus.APPROVED).count()
+    booking_counts = read_counts(db.session.connection(), BOOKINGS)
+    total_bookings = sum(booking_counts.values())
+    pending_bookings = booking_counts.get(BookingStatus.PENDING.value, 0)
+    approved_bookings = booking_counts.get(BookingStatus.APPROVED.value, 0)
     
     return render_template('admin_dashboard.html',
                          recent_issues=recent_issues,
@@ -149,14 +240,7 @@ def chatbot():
     if session_id:
         chat_session = ChatSession.query.filter_by(session_id=session_id).first()
     if not session_id or not chat_session:
-        session_id = str(uuid.uuid4())
-        session['chat_session_id'] = session_id
-
-        chat_session = ChatSession()
-        chat_session.user_id = current_user.id
-        chat_session.session_id = session_id
-        db.session.add(chat_session)
-        db.session.commit()
+        start_chat_session()
     
     # Get context from URL parameters
     facility = request.args.get('facility', '')
@@ -170,13 +254,31 @@ def chatbot():
                          context_type=context,
                          initial_message=initial_message)
 
+def start_chat_session():
+    """Create a new chat session for the current user and remember it in the Flask session"""
+    session_id = str(uuid.uuid4())
+    session['chat_session_id'] = session_id
+
+    chat_session = ChatSession()
+    chat_session.user_id = current_user.id
+    chat_session.session_id = session_id
+    db.session.add(chat_session)
+    db.session.commit()
+    return chat_session
+
+@app.route('/api/chat/new_session', methods=['POST'])
+@login_required
+def new_chat_session():
+    """Start a fresh conversation (used when the student clears the chat)"""
+    start_chat_session()
+    return jsonify({'status': 'ok'})
+
 @app.route('/api/chat', methods=['POST'])
 @login_required
 def chat_api():
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
-        chat_history = data.get('history', [])  # <-- get history from request
 
         if not user_message:
             return jsonify({'error': 'Message cannot be empty'}), 400
@@ -188,26 +290,37 @@ def chat_api():
         if not chat_session:
             return jsonify({'error': 'Chat session not found'}), 400
         
-        # Process message with AI, now passing chat_history as user_context
-        intent_data = ai_service.extract_entities_and_intent(user_message)
-        bot_response = ai_service.generate_response(user_message, intent_data, user_context={'history': chat_history})
-
-        # Save user message
-        user_msg = ChatMessage()
-        user_msg.session_id = chat_session.id
-        user_msg.message = user_message
-        user_msg.is_user = True
-        user_msg.intent = intent_data.get('intent')
-        user_msg.entities = intent_data.get('entities')
-        db.session.add(user_msg)
-        
-        # Save bot response
-        bot_msg = ChatMessage()
-        bot_msg.session_id = chat_session.id
-        bot_msg.message = bot_response
-        bot_msg.is_user = False
-        db.session.add(bot_msg)
-        db.session.commit()
+        # Process message with AI. History comes from the stored messages of this session,
+        # never from the client; older turns are folded into the session's rolling summary.
+        # CHAT_MODE selects two LLM calls or one combined call; the session id keeps A/B arms stable.
+        # All LLM calls below share one deadline, so a slow provider cannot hold the worker for minutes.
+        # Turns over the worker's chat limit are shed instead of queueing behind LLM calls.
+        # Factual facility lookups are answered from the facility data without the LLM.
+        llm_stats = None
+        answered = ai_service.structured_answer(user_message)
+        if not answered:
+            # Only turns that may reach the LLM use up the student's rate limit
+            retry_after = ai_service.user_rate_limiter.acquire(current_user.id)
+            if retry_after:
+                return too_many_requests(RATE_LIMITED_MESSAGE, retry_after)
+        if answered:
+            intent_data, bot_response = answered
+        elif ai_service.admission.try_acquire():
+            try:
+                with record_turn() as turn, deadline_scope(ai_service.request_deadline):
+                    user_context = ai_service.budget_history(chat_session)
+                    user_context['session_id'] = session_id
+                    intent_data, bot_response = ai_service.process_message(user_message, user_context=user_context)
+                if ai_service.persist_llm_stats:
+                    llm_stats = turn.summary()
+            finally:
+                ai_service.admission.release()
+        elif ai_service.chat_shed_mode == '429':
+            return too_many_requests(BUSY_MESSAGE, ai_service.admission.wait_timeout)
+        else:
+            intent_data, bot_response = ai_service.shed_message(user_message)
+
+        save_chat_turn(chat_session.id, user_message, intent_data, bot_response, llm_stats=llm_stats)
         
         return jsonify({
             'response': bot_response,
@@ -219,6 +332,137 @@ def chat_api():
         print(f"Chat API error: {e}")
         return jsonify({'error': 'Failed to process message'}), 500
 
+BUSY_MESSAGE = 'The campus assistant is busy right now. Please try again in a few seconds.'
+RATE_LIMITED_MESSAGE = 'You are sending messages too quickly. Please wait a moment.'
+
+def too_many_requests(message, retry_after):
+    """HTTP 429 JSON error with a Retry-After header in whole seconds"""
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def save_chat_turn(chat_session_id, user_message, intent_data, bot_response, llm_stats=None):
+    """Persist one user message and the bot reply to it (and any pending chat session summary update)"""
+    # Save user message
+    user_msg = ChatMessage()
+    user_msg.session_id = chat_session_id
+    user_msg.message = user_message
+    user_msg.is_user = True
+    user_msg.intent = intent_data.get('intent')
+    user_msg.intent_source = intent_data.get('source')
+    user_msg.entities = intent_data.get('entities')
+    db.session.add(user_msg)
+    
+    # Save bot response
+    bot_msg = ChatMessage()
+    bot_msg.session_id = chat_session_id
+    bot_msg.message = bot_response
+    bot_msg.is_user = False
+    bot_msg.llm_stats = llm_stats
+    db.session.add(bot_msg)
+    db.session.commit()
+
+def sse_event(event, data):
+    """Format one Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required
+def chat_stream_api():
+    """Same as /api/chat, but streams the reply to the browser as Server-Sent Events"""
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '').strip()
+
+    if not user_message:
+        return jsonify({'error': 'Message cannot be empty'}), 400
+
+    session_id = session.get('chat_session_id')
+    chat_session = ChatSession.query.filter_by(session_id=session_id).first()
+
+    if not chat_session:
+        return jsonify({'error': 'Chat session not found'}), 400
+
+    chat_session_id = chat_session.id
+
+    # Factual facility lookups need no LLM call, no admission slot and no rate limit token
+    answered = ai_service.structured_answer(user_message)
+    if not answered:
+        retry_after = ai_service.user_rate_limiter.acquire(current_user.id)
+        if retry_after:
+            return too_many_requests(RATE_LIMITED_MESSAGE, retry_after)
+
+    # The admission slot is held until the stream is closed, not just until this view returns
+    admitted = not answered and ai_service.admission.try_acquire()
+    if not answered and not admitted and ai_service.chat_shed_mode == '429':
+        return too_many_requests(BUSY_MESSAGE, ai_service.admission.wait_timeout)
+
+    def generate():
+        try:
+            llm_stats = None
+            truncated = False
+            if answered:
+                # Rendered from the facility data, delivered in the 'done' event
+                intent_data, bot_response = answered
+            elif admitted:
+                # The deadline covers every LLM call of this reply, including the summary update
+                with record_turn() as turn, deadline_scope(ai_service.request_deadline):
+                    user_context = ai_service.budget_history(chat_session)
+                    user_context['session_id'] = session_id
+                    # Same CHAT_MODE (and A/B arm) as /api/chat. Only two_call streams the reply
+                    # as it is written; combined and parallel replies arrive whole, as one token.
+                    mode = ai_service.resolve_chat_mode(session_id)
+                    if mode == 'two_call':
+                        mark_chat_mode(mode)
+                        intent_data = ai_service.extract_entities_and_intent(user_message)
+                        yield sse_event('meta', {
+                            'intent': intent_data.get('intent'),
+                            'entities': intent_data.get('entities')
+                        })
+
+                        parts = []
+                        for text in ai_service.generate_response_stream(user_message, intent_data, user_context=user_context):
+                            parts.append(text)
+                            yield sse_event('token', {'text': text})
+                        bot_response = "".join(parts).strip()
+                    else:
+                        intent_data, bot_response = ai_service.process_message(user_message, user_context=user_context)
+                        yield sse_event('meta', {
+                            'intent': intent_data.get('intent'),
+                            'entities': intent_data.get('entities')
+                        })
+                        yield sse_event('token', {'text': bot_response})
+
+                truncated = turn.truncated
+                if ai_service.persist_llm_stats or truncated:
+                    llm_stats = turn.summary()
+            else:
+                # Shed: rule-based answer, delivered in the 'done' event
+                intent_data, bot_response = ai_service.shed_message(user_message)
+
+            save_chat_turn(chat_session_id, user_message, intent_data, bot_response, llm_stats=llm_stats)
+            done = {
+                'response': bot_response,
+                'intent': intent_data.get('intent'),
+                'entities': intent_data.get('entities')
+            }
+            if truncated:
+                done['truncated'] = True
+                done['error'] = 'The reply was cut short. Please ask again for the rest.'
+            yield sse_event('done', done)
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            db.session.rollback()
+            yield sse_event('error', {'error': 'Failed to process message'})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
+    })
+    if admitted:
+        response.call_on_close(ai_service.admission.release)
+    return response
+
 @app.route('/report_issue', methods=['GET', 'POST'])
 @login_required
 def report_issue():
@@ -251,20 +495,27 @@ def report_issue():
             form.title.data = f'Issue with {facility_name}'
     
     if form.validate_on_submit():
-        # Use AI to enhance issue classification
-        ai_classification = ai_service.classify_issue_from_description(form.description.data)
-        
+        # Save with the student's own type and priority so the form returns immediately
         issue = Issue()
         issue.title = form.title.data
         issue.description = form.description.data
-        issue.issue_type = IssueType(ai_classification.get('issue_type', form.issue_type.data))
-        issue.priority = Priority(ai_classification.get('priority', form.priority.data))
+        issue.issue_type = IssueType(form.issue_type.data)
+        issue.priority = Priority(form.priority.data)
         issue.location = form.location.data
         issue.user_id = current_user.id
         
         db.session.add(issue)
         db.session.commit()
         
+        # Use AI to enhance issue classification in the background
+        try:
+            enqueue('classify_issue', {'issue_id': issue.id,
+                                       'issue_type': issue.issue_type.value,
+                                       'priority': issue.priority.value})
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not queue issue classification: {e}")
+        
         flash(f'Issue reported successfully! (ID: {issue.id})', 'success')
         return redirect(url_for('student_dashboard'))
     
@@ -607,10 +858,38 @@ def refresh_cache():
         flash('Access denied.', 'danger')
         return redirect(url_for('index'))
     
-    ai_service.load_facilities()
+    # Bumping the version makes every worker reload, not just this one
+    bump_version(db.session.connection(), FACILITIES)
+    db.session.commit()
+    ai_service.invalidate_facility_data()
     flash('AI service cache refreshed successfully!', 'success')
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/ai_stats')
+@login_required
+def ai_stats():
+    """AI service runtime counters for this worker process (admin only)"""
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Access denied'}), 403
+    
+    stats = ai_service.get_stats()
+    stats['job_queue'] = queue_depth()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics for this worker process. Admins can open it in the
+    browser; a scraper sends "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    if not scraper and not (current_user.is_authenticated and current_user.role == UserRole.ADMIN):
+        return jsonify({'error': 'Access denied'}), 403
+
+    return Response(ai_service.prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+
 # Facility Booking Routes
 @app.route('/book_facility', methods=['GET', 'POST'])
 @login_required
@@ -670,7 +949,7 @@ def book_facility():
 @login_required
 def my_bookings():
     """View user's bookings"""
-    bookings = FacilityBooking.query.filter_by(user_id=current_user.id).order_by(
+    bookings = FacilityBooking.query.filter_by(user_id=current_user.id).options(*BOOKING_LIST_OPTIONS).order_by(
         FacilityBooking.booking_date.desc(),
         FacilityBooking.start_hour.desc()
     ).all()
@@ -692,7 +971,7 @@ def facility_schedule(facility_id):
         FacilityBooking.booking_date >= start_date,
         FacilityBooking.booking_date <= end_date,
         FacilityBooking.status.in_([BookingStatus.PENDING, BookingStatus.APPROVED])
-    ).order_by(FacilityBooking.booking_date, FacilityBooking.start_hour).all()
+    ).options(*BOOKING_LIST_OPTIONS).order_by(FacilityBooking.booking_date, FacilityBooking.start_hour).all()
     
     return render_template('facility_schedule.html', facility=facility, bookings=bookings)
 
@@ -704,12 +983,49 @@ def manage_bookings():
         flash('Access denied.', 'error')
         return redirect(url_for('index'))
     
-    bookings = FacilityBooking.query.order_by(
-        FacilityBooking.booking_date.desc(),
-        FacilityBooking.start_hour.desc()
-    ).all()
+    cursor = decode_cursor(request.args.get('after'), (date.fromisoformat, int, int))
+    query = filter_bookings(FacilityBooking.query.options(*BOOKING_LIST_OPTIONS), request.args, cursor)
+    bookings, next_key = keyset_page(query, BOOKING_LIST_ORDER, cursor, ADMIN_PAGE_SIZE, descending=True)
+    
+    booking_counts = read_counts(db.session.connection(), BOOKINGS)
+    facilities = Facility.query.filter_by(is_bookable=True).order_by(Facility.name).all()
+    
+    return render_template('manage_bookings.html',
+                         bookings=bookings,
+                         booking_counts=booking_counts,
+                         total_bookings=sum(booking_counts.values()),
+                         facilities=facilities,
+                         statuses=list(BookingStatus),
+                         filters=request.args,
+                         first_url=_page_url('manage_bookings') if cursor is not None else None,
+                         next_url=_page_url('manage_bookings', next_key) if next_key is not None else None)
+
+@app.route('/issue_queue')
+@login_required
+def issue_queue():
+    """Admin triage queue: issues by priority, oldest first"""
+    if current_user.role != UserRole.ADMIN:
+        flash('Access denied. Admins only.', 'danger')
+        return redirect(url_for('index'))
+    
+    query = filter_issues(Issue.query.options(*ISSUE_QUEUE_OPTIONS), request.args)
+    cursor = decode_cursor(request.args.get('after'), (Priority, datetime.fromisoformat, int))
+    issues, next_key = grouped_keyset_page(query, Issue.priority, ISSUE_QUEUE_PRIORITIES,
+                                           ISSUE_QUEUE_ORDER, cursor, ADMIN_PAGE_SIZE)
+    
+    issue_counts = read_counts(db.session.connection(), ISSUES)
+    facilities = Facility.query.order_by(Facility.name).all()
     
-    return render_template('manage_bookings.html', bookings=bookings)
+    return render_template('issue_queue.html',
+                         issues=issues,
+                         issue_counts=issue_counts,
+                         total_issues=sum(issue_counts.values()),
+                         facilities=facilities,
+                         statuses=list(IssueStatus),
+                         issue_types=list(IssueType),
+                         filters=request.args,
+                         first_url=_page_url('issue_queue') if cursor is not None else None,
+                         next_url=_page_url('issue_queue', next_key) if next_key is not None else None)
 
 @app.route('/update_booking/<int:booking_id>', methods=['GET', 'POST'])
 @login_required
@@ -751,6 +1067,8 @@ def reset_database():
         for user in student_users:
             db.session.delete(user)
         
+        # The bulk deletes above bypass the counter events
+        rebuild_counts(db.session.connection())
         db.session.commit()
         
         # Recreate sample facilities if they don't exist
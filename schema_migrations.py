@@ -0,0 +1,38 @@
+import logging
+from sqlalchemy import inspect, text
+
+# db.create_all() creates missing tables but never changes existing ones, so
+# columns added to models after a database was created are listed here and
+# added in place, and indexes declared on the models are created if missing.
+# Every step is idempotent and safe to run at each startup.
+
+ADDED_COLUMNS = [
+    # (table, column, column DDL)
+    ('chat_sessions', 'summary', 'TEXT'),
+    ('chat_sessions', 'summarized_count', 'INTEGER DEFAULT 0'),
+    ('chat_messages', 'llm_stats', 'JSON'),
+    ('chat_messages', 'intent_source', 'VARCHAR(20)'),
+]
+
+def upgrade_schema(db):
+    """Bring an existing database up to date with the current models"""
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in tables:
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                logging.info(f"Added column {table}.{column}")
+
+        # Create any index declared in the models (__table_args__) that is missing
+        for table in db.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+                    logging.info(f"Created index {index.name} on {table.name}")
@@ -0,0 +1,80 @@
+import threading
+
+from resilience import DeadlineExceeded, RequestCancelled, remaining_time
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time within this worker. A caller whose
+    key is already in flight waits for that call's result instead of making
+    the same LLM request again.
+
+    A follower waits at most `wait_timeout` seconds, and never past its own
+    request deadline. If the leader is still busy after that, the follower
+    makes its own call while its deadline allows. When the leader failed
+    because of its own deadline or cancellation, followers also make their
+    own call. Any other error is shared, like a result.
+    """
+
+    def __init__(self, wait_timeout: float = 10.0):
+        self.wait_timeout = wait_timeout
+        self.leaders = 0
+        self.coalesced = 0
+        self.wait_timeouts = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        timeout = self.wait_timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = min(timeout, max(0.0, remaining))
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.wait_timeouts += 1
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded("LLM deadline exceeded waiting for an identical request")
+            return fn()
+        if isinstance(call.error, (DeadlineExceeded, RequestCancelled)):
+            return fn()
+        with self._lock:
+            self.coalesced += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "wait_timeouts": self.wait_timeouts,
+            }
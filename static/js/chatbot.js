@@ -54,9 +54,6 @@ class ChatBot {
         // Disable input and show loading state
         this.setInputState(false);
         
-        // Get chat history
-        const history = this.getChatHistory();
-
         // Add user message to chat
         this.addUserMessage(message);
         
@@ -68,14 +65,15 @@ class ChatBot {
         this.showTypingIndicator();
         
         try {
-            // Send message to backend
-            const response = await this.sendToAPI(message, history);
-            
-            // Remove typing indicator
-            this.hideTypingIndicator();
-            
-            // Add bot response
-            this.addBotMessage(response.response, response.intent, response.entities);
+            // Stream the reply token by token; fall back to the blocking endpoint
+            // if the browser cannot read response streams
+            if (window.ReadableStream && window.TextDecoder) {
+                await this.streamFromAPI(message);
+            } else {
+                const response = await this.sendToAPI(message);
+                this.hideTypingIndicator();
+                this.addBotMessage(response.response, response.intent, response.entities);
+            }
             
         } catch (error) {
             console.error('Chat error:', error);
@@ -83,9 +81,9 @@ class ChatBot {
             // Remove typing indicator
             this.hideTypingIndicator();
             
-            // Show error message
+            // Show error message (the server's own wording when it asked us to slow down)
             this.addBotMessage(
-                "I'm sorry, I'm having trouble processing your request right now. Please try again or contact support for assistance.",
+                error.userMessage || "I'm sorry, I'm having trouble processing your request right now. Please try again or contact support for assistance.",
                 'error'
             );
         } finally {
@@ -95,58 +93,125 @@ class ChatBot {
         }
     }
     
-    async sendToAPI(message, history) {
-        // Prepare chat history if not provided
-        if (!history) {
-            history = [];
+    async streamFromAPI(message) {
+        const response = await fetch('/api/chat/stream', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
+            },
+            body: JSON.stringify({
+                message: message
+            })
+        });
+
+        if (response.status === 429) {
+            throw await this.rateLimitError(response);
+        }
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let text = '';
+        let intent = null;
+        let entities = null;
+        let messageElement = null;
+        let finished = false;
+
+        const handleEvent = (event, data) => {
+            if (event === 'meta') {
+                intent = data.intent;
+                entities = data.entities;
+            } else if (event === 'token') {
+                text += data.text;
+                if (!messageElement) {
+                    // First token: swap the typing indicator for the reply bubble
+                    this.hideTypingIndicator();
+                    messageElement = this.createMessageElement('', false);
+                    this.messagesContainer.appendChild(messageElement);
+                    this.messageCount++;
+                }
+                this.updateBotMessage(messageElement, text);
+            } else if (event === 'done') {
+                // A reply cut short mid-stream says so instead of just stopping
+                const reply = data.truncated ? `${data.response}\n\n⚠️ ${data.error}` : data.response;
+                if (!messageElement) {
+                    this.hideTypingIndicator();
+                    this.addBotMessage(reply, data.intent, data.entities);
+                } else {
+                    this.updateBotMessage(messageElement, reply, data.intent, data.entities);
+                }
+                finished = true;
+            } else if (event === 'error') {
+                throw new Error(data.error || 'Stream error');
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            // SSE frames are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const frame = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                frame.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                });
+                if (data) {
+                    handleEvent(event, JSON.parse(data));
+                }
+            }
+        }
+
+        if (!finished) {
+            throw new Error('Stream ended without a response');
         }
+        this.hideTypingIndicator();
+    }
+    
+    async sendToAPI(message) {
+        // The server keeps the conversation history for this chat session
         const response = await fetch('/api/chat', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                message: message,
-                history: history // <-- send history to backend
+                message: message
             })
         });
 
+        if (response.status === 429) {
+            throw await this.rateLimitError(response);
+        }
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
         return await response.json();
     }
-    
-    getChatHistory() {
-        const messages = [];
-        this.messagesContainer.querySelectorAll('.message').forEach(msgDiv => {
-            // User message
-            if (msgDiv.classList.contains('user-message')) {
-                const text = msgDiv.querySelector('.message-bubble p')?.textContent || '';
-                messages.push({ sender: 'user', text });
-            }
-            // Bot message
-            else if (msgDiv.classList.contains('bot-message')) {
-                // Get the first child div inside .message-bubble (the actual bot reply)
-                const bubble = msgDiv.querySelector('.message-bubble');
-                let text = '';
-                if (bubble) {
-                    // Find the first child that is a DIV and not a time/debug info
-                    const firstDiv = Array.from(bubble.children).find(
-                        el => el.tagName === 'DIV' && !el.className.includes('message-time')
-                    );
-                    text = firstDiv ? firstDiv.textContent : bubble.textContent;
-                }
-                messages.push({ sender: 'bot', text: text.trim() });
-            }
-            // System message
-            else if (msgDiv.classList.contains('system-message')) {
-                const text = msgDiv.textContent || '';
-                messages.push({ sender: 'system', text });
-            }
-        });
-        return messages;
+
+    async rateLimitError(response) {
+        // Rate limited or shed: show the server's message instead of the generic error
+        const data = await response.json().catch(() => ({}));
+        const error = new Error(`HTTP error! status: ${response.status}`);
+        error.userMessage = data.error;
+        return error;
     }
 
     addUserMessage(message) {
@@ -163,6 +228,32 @@ class ChatBot {
         this.messageCount++;
     }
     
+    updateBotMessage(messageElement, message, intent = null, entities = null) {
+        const bubble = messageElement.querySelector('.message-bubble');
+        bubble.firstElementChild.innerHTML = this.formatBotMessage(message);
+
+        if (intent || entities) {
+            const debugDiv = document.createElement('div');
+            debugDiv.innerHTML = this.buildDebugInfo(intent, entities);
+            if (debugDiv.firstElementChild) {
+                bubble.appendChild(debugDiv.firstElementChild);
+            }
+        }
+        this.scrollToBottom();
+    }
+    
+    buildDebugInfo(intent, entities) {
+        if (!intent && !entities) {
+            return '';
+        }
+        return `
+            <div class="mt-2 p-2 rounded" style="font-size: 0.75rem; background-color: #e2e3e5;">
+                ${intent ? `<div><strong>Intent:</strong> ${intent}</div>` : ''}
+                ${entities && Object.keys(entities).length > 0 ? `<div><strong>Entities:</strong> ${JSON.stringify(entities)}</div>` : ''}
+            </div>
+        `;
+    }
+    
     createMessageElement(message, isUser, intent = null, entities = null) {
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${isUser ? 'user-message' : 'bot-message'}`;
@@ -186,15 +277,7 @@ class ChatBot {
                 </div>
             `;
         } else {
-            let debugInfo = '';
-            if (intent || entities) {
-                debugInfo = `
-                    <div class="mt-2 p-2 rounded" style="font-size: 0.75rem; background-color: #e2e3e5;">
-                        ${intent ? `<div><strong>Intent:</strong> ${intent}</div>` : ''}
-                        ${entities && Object.keys(entities).length > 0 ? `<div><strong>Entities:</strong> ${JSON.stringify(entities)}</div>` : ''}
-                    </div>
-                `;
-            }
+            const debugInfo = this.buildDebugInfo(intent, entities);
             
             messageDiv.innerHTML = `
                 <div class="message-content">
@@ -332,6 +415,10 @@ class ChatBot {
         const messages = this.messagesContainer.querySelectorAll('.message:not(:first-child)');
         messages.forEach(message => message.remove());
         this.messageCount = 1; // Reset count but keep welcome message
+
+        // History lives on the server, so start a new chat session there as well
+        fetch('/api/chat/new_session', { method: 'POST' })
+            .catch(error => console.error('Failed to start a new chat session:', error));
     }
 }
 
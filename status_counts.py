@@ -0,0 +1,84 @@
+import enum
+from sqlalchemy import delete, event, func, insert, inspect, select
+from db_config import increment
+from models import FacilityBooking, Issue, StatusCount
+
+# Dashboard counters. Instead of counting issues and bookings on every page
+# view, status_counts holds the number of rows per status, overall and per
+# user. Mapper events adjust it in the same transaction as each insert,
+# delete or status change, so reading the dashboard numbers costs a few
+# primary key lookups whatever the size of the tables.
+#
+# Bulk query.delete() calls skip mapper events; callers that use them call
+# rebuild_counts(), as does `flask --app main reconcile-counts`.
+
+ISSUES = 'issues'
+BOOKINGS = 'facility_bookings'
+ALL_USERS = 0
+
+COUNTED_MODELS = {ISSUES: Issue, BOOKINGS: FacilityBooking}
+
+_table = StatusCount.__table__
+
+def _status(value):
+    return value.value if isinstance(value, enum.Enum) else value
+
+def add_count(connection, name, user_id, status, delta):
+    """Adjust the overall and per-user count of a status, inside the caller's transaction"""
+    status = _status(status)
+    for counted_user in (ALL_USERS, user_id):
+        increment(connection, _table, {"name": name, "user_id": counted_user, "status": status}, "count", delta)
+
+def counts_query(name, user_id=ALL_USERS):
+    return select(_table.c.status, _table.c.count).where(_table.c.name == name, _table.c.user_id == user_id)
+
+def read_counts(connection, name, user_id=ALL_USERS):
+    """{status value: rows} for a table, overall or for one user"""
+    return {status: count for status, count in connection.execute(counts_query(name, user_id)) if count}
+
+def rebuild_counts(connection):
+    """Recount every table in one GROUP BY pass each; returns the new {(name, user_id, status): count}"""
+    counts = {}
+    for name, model in COUNTED_MODELS.items():
+        rows = connection.execute(
+            select(model.user_id, model.status, func.count()).group_by(model.user_id, model.status)
+        )
+        for user_id, status, count in rows:
+            status = _status(status)
+            counts[(name, user_id, status)] = count
+            counts[(name, ALL_USERS, status)] = counts.get((name, ALL_USERS, status), 0) + count
+    connection.execute(delete(_table))
+    if counts:
+        connection.execute(insert(_table), [
+            {"name": name, "user_id": user_id, "status": status, "count": count}
+            for (name, user_id, status), count in counts.items()
+        ])
+    return counts
+
+def ensure_counts(engine):
+    """Fill an empty counters table, e.g. the first time a database with data is upgraded"""
+    with engine.begin() as conn:
+        if conn.execute(select(func.count()).select_from(_table)).scalar() == 0:
+            rebuild_counts(conn)
+
+def _inserted(mapper, connection, target):
+    add_count(connection, target.__tablename__, target.user_id, target.status, 1)
+
+def _deleted(mapper, connection, target):
+    add_count(connection, target.__tablename__, target.user_id, target.status, -1)
+
+def _updated(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if history.deleted and history.added and history.deleted[0] != history.added[0]:
+        add_count(connection, target.__tablename__, target.user_id, history.deleted[0], -1)
+        add_count(connection, target.__tablename__, target.user_id, history.added[0], 1)
+
+def _load_old_status(target, value, oldvalue, initiator):
+    return value
+
+for _model in COUNTED_MODELS.values():
+    event.listen(_model, 'after_insert', _inserted)
+    event.listen(_model, 'after_delete', _deleted)
+    event.listen(_model, 'after_update', _updated)
+    # active_history loads the previous status before it is replaced, even on an expired object
+    event.listen(_model.status, 'set', _load_old_status, active_history=True, retval=True)
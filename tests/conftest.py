@@ -0,0 +1,13 @@
+import os
+
+# Tests never touch a real database: each run gets a fresh in-memory SQLite one
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["AUTO_INIT_DB"] = "1"
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def app():
+    from flask_app import create_app
+    return create_app()
@@ -0,0 +1,18 @@
+import routes
+from query_counts import LIST_PAGES, compare_statement_counts
+
+
+def test_list_pages_run_the_same_statements_for_more_rows(app):
+    with app.app_context():
+        before, after = compare_statement_counts(2)
+    assert set(before) == {endpoint for endpoint, _, _ in LIST_PAGES}
+    assert after == before
+
+
+def test_a_lazy_loaded_relation_is_reported(app, monkeypatch):
+    monkeypatch.setattr(routes, "BOOKING_LIST_OPTIONS", ())
+    monkeypatch.setattr(routes, "ISSUE_QUEUE_OPTIONS", ())
+    with app.app_context():
+        before, after = compare_statement_counts(2)
+    assert after["manage_bookings"] > before["manage_bookings"]
+    assert after["issue_queue"] > before["issue_queue"]
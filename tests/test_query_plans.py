@@ -0,0 +1,35 @@
+from sqlalchemy import create_engine, text
+
+from flask_app import db
+from query_plans import explain, full_scans, hot_queries, paged_queries, sorts
+
+
+def _problems(conn, queries, paged=False):
+    """{query name: plan} for the queries that scan a table (or, for pages, sort)"""
+    tables = set(db.metadata.tables)
+    problems = {}
+    for name, statement in queries:
+        plan = explain(conn, statement)
+        if full_scans(plan, tables) or (paged and sorts(plan)):
+            problems[name] = plan
+    return problems
+
+
+def test_hot_queries_use_an_index(app):
+    with app.app_context(), db.engine.connect() as conn:
+        assert _problems(conn, hot_queries()) == {}
+
+
+def test_admin_pages_are_read_in_index_order(app):
+    with app.app_context(), db.engine.connect() as conn:
+        assert _problems(conn, paged_queries(), paged=True) == {}
+
+
+def test_a_missing_index_is_reported(app):
+    # A separate database, so the dropped index does not affect the other tests
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    with app.app_context(), engine.connect() as conn:
+        conn.execute(text("DROP INDEX ix_chat_sessions_session_id"))
+        problems = _problems(conn, hot_queries())
+    assert list(problems) == ["chat: session by session_id"]